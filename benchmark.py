@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+'''
+Hardware-free benchmarks for tm1640.py and segment7.py.
+
+Runs against gpiozero's MockFactory, so no Raspberry Pi is needed. Results are
+printed and can be saved as JSON, to be compared against a previous run:
+
+    ./benchmark.py --output before.json
+    (change something)
+    ./benchmark.py --output after.json --compare before.json
+'''
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from gpiozero.pins.mock import MockFactory
+
+import segment7
+from carousel import encode_frame
+from tm1640 import MultiTM1640, TM1640
+from transitions import EFFECTS, Transition
+
+
+# Strings similar to what the views display.
+SAMPLE_TEXTS = [
+    '12-34-56  Mon 01',
+    'Brazil 08_15‾42',
+    '192.168.1.23 eth0',
+    ' 45°C   1500MHz',
+    'load 0.52 0.48 0.41',
+    'RAM 4G  2.5G free',
+    "baby 2y 1m 15d",
+]
+
+
+def clock_texts(count:int):
+    '''Clock-like frames, where usually only the last digits change.'''
+    return ['{:02d}-{:02d}-{:02d}  Mon 01'.format(i // 3600 % 24, i // 60 % 60, i % 60) for i in range(count)]
+
+
+def random_payloads(count:int, width:int = 16):
+    '''Frames where (almost) every digit changes.'''
+    return [bytes((i * 37 + j * 11) & 0xFF for j in range(width)) for i in range(count)]
+
+
+def transition_frames(count:int):
+    '''The intermediate frames of all the transitions between the sample texts.'''
+    encoded = [encode_frame(text) for text in SAMPLE_TEXTS]
+    frames = []
+    while len(frames) < count:
+        for (old, new) in zip(encoded, encoded[1:] + encoded[:1]):
+            for effect in EFFECTS:
+                frames.extend(Transition(old, new, effect).frames)
+    return frames[:count]
+
+
+def new_display():
+    display = TM1640(clk_pin=24, din_pin=23, pin_factory=MockFactory())
+    return display
+
+
+def output_devices(display):
+    # MultiTM1640 has several DIN pins.
+    dins = display.dins if hasattr(display, 'dins') else [display.din]
+    return [display.clk, *dins]
+
+
+def pin_transitions(display):
+    return sum(len(device.pin.states) - 1 for device in output_devices(display))
+
+
+def clear_pins(display):
+    for device in output_devices(display):
+        device.pin.clear_states()
+
+
+def bench_frames(name:str, write, frames, display):
+    '''Calls write(frame) for each frame, returns a result dict.'''
+    clear_pins(display)
+    bytes_before = display.bytes_sent
+    start = time.perf_counter()
+    for frame in frames:
+        write(frame)
+    elapsed = time.perf_counter() - start
+    count = len(frames)
+    return {
+        'name': name,
+        'frames': count,
+        'seconds': elapsed,
+        'fps': count / elapsed,
+        'bytes_per_frame': (display.bytes_sent - bytes_before) / count,
+        'pin_transitions_per_frame': pin_transitions(display) / count,
+    }
+
+
+def bench_encode(name:str, encode, texts, repeat:int):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for text in texts:
+            encode(text)
+    elapsed = time.perf_counter() - start
+    count = repeat * len(texts)
+    return {
+        'name': name,
+        'strings': count,
+        'seconds': elapsed,
+        'usec_per_string': elapsed / count * 1e6,
+    }
+
+
+def run_benchmarks(frames:int, repeat:int):
+    results = []
+
+    with new_display() as display:
+        results.append(bench_frames('write_text clock', display.write_text, clock_texts(frames), display))
+    with new_display() as display:
+        results.append(bench_frames('write_text samples', display.write_text, (SAMPLE_TEXTS * frames)[:frames], display))
+    with new_display() as display:
+        results.append(bench_frames('write_bytes random', display.write_bytes, random_payloads(frames), display))
+    with new_display() as display:
+        # Must stay well above 50 fps on the Pi.
+        results.append(bench_frames('write_bytes transitions', display.write_bytes, transition_frames(frames), display))
+    with MultiTM1640(clk_pin=24, din_pins=[23, 22, 27, 17], pin_factory=MockFactory()) as display:
+        results.append(bench_frames('MultiTM1640 x4 write_bytes random', display.write_bytes, random_payloads(frames, 64), display))
+    with new_display() as display:
+        # Alternating between two values, otherwise the setter does nothing.
+        def set_brightness(value):
+            display.brightness = value
+        results.append(bench_frames('brightness', set_brightness, [1 + i % 2 for i in range(frames)], display))
+
+    results.append(bench_encode(
+        'segment7.char_to_bin',
+        lambda text: [segment7.char_to_bin(c) for c in text],
+        SAMPLE_TEXTS, repeat))
+    results.append(bench_encode(
+        'segment7.encode uncached',
+        segment7.encode.__wrapped__,
+        SAMPLE_TEXTS, repeat))
+    results.append(bench_encode(
+        'segment7.encode cached',
+        segment7.encode,
+        SAMPLE_TEXTS, repeat))
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    previous = {r['name']: r for r in (previous or [])}
+    for r in results:
+        if 'fps' in r:
+            line = '{name:36} {fps:10.1f} fps  {bytes_per_frame:5.1f} bytes/frame  {pin_transitions_per_frame:6.1f} transitions/frame'.format(**r)
+            key = 'fps'
+        else:
+            line = '{name:36} {usec_per_string:10.3f} µs/string'.format(**r)
+            key = 'usec_per_string'
+        old = previous.get(r['name'])
+        if old and old.get(key):
+            line += '  ({:+.1f}% vs previous)'.format((r[key] / old[key] - 1) * 100)
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=2000, help='Number of frames for each display benchmark')
+    parser.add_argument('--repeat', type=int, default=20000, help='Number of repetitions for each encoding benchmark')
+    parser.add_argument('--output', '-o', help='Save the results as JSON to this file')
+    parser.add_argument('--compare', '-c', help='Compare against results previously saved as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args.frames, args.repeat)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version,
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+Calibrated timing for the TM1640 bus.
+
+The datasheet gives a maximum clock frequency of 1MHz, so two consecutive pin
+changes must be at least 500ns apart. On a Raspberry Pi, interpreted Python is
+usually slow enough to respect that without waiting at all, but a faster Pi or
+a faster Python may not be. And time.sleep() is far too coarse to wait for
+less than a microsecond.
+
+Instead of guessing, calibrate() measures how long a single pin change takes
+on this machine, then picks the `sleep` function for TM1640: no_sleep if the
+pin changes are already slow enough, or a busy-wait on perf_counter_ns() for
+just the missing time. It also measures and reports the achieved bit rate.
+'''
+
+import warnings
+from collections import namedtuple
+from time import perf_counter_ns
+from tm1640 import count_edges, no_sleep
+
+
+# From the datasheet.
+MAX_CLOCK_HZ = 1_000_000
+
+# The data command in auto-increment address mode, harmless to send at any time; see TM1640.send_data_command().
+DATA_COMMAND = 0b_0100_0000
+
+BusTiming = namedtuple('BusTiming', 'min_interval_ns write_ns wait_ns edge_ns bit_rate max_clock_hz')
+
+
+def busy_wait(interval_ns:int):
+    '''Returns a `sleep` function for TM1640 that spins for interval_ns nanoseconds.'''
+    def sleep():
+        deadline = perf_counter_ns() + interval_ns
+        while perf_counter_ns() < deadline:
+            pass
+    sleep.interval_ns = interval_ns
+    return sleep
+
+
+def timer_overhead_ns(samples:int = 1000) -> int:
+    '''Returns the shortest time between two consecutive perf_counter_ns() calls.'''
+    best = None
+    for i in range(samples):
+        t0 = perf_counter_ns()
+        t1 = perf_counter_ns()
+        if best is None or t1 - t0 < best:
+            best = t1 - t0
+    return best
+
+
+def measure_write_ns(display, samples:int = 1000) -> int:
+    '''Returns the shortest time a single pin change takes on this display.
+
+    Only CLK is toggled, while DIN is high: without a start condition, the chip ignores it.
+    '''
+    write = display.clock_writer()
+    overhead = timer_overhead_ns(samples)
+    best = None
+    value = False
+    for i in range(samples):
+        t0 = perf_counter_ns()
+        write(value)
+        t1 = perf_counter_ns()
+        value = not value
+        if best is None or t1 - t0 < best:
+            best = t1 - t0
+    # CLK is left high, as usual between commands.
+    write(True)
+    return max(0, best - overhead)
+
+
+def measure_bus(display, commands:int = 50):
+    '''Sends the data command repeatedly, with the current `sleep` of the display.
+
+    Returns (average nanoseconds per pin change, bits per second), including the start and end conditions. This traffic is not counted in the metrics of the display.
+    '''
+    start = perf_counter_ns()
+    display.send_data_command(commands)
+    elapsed = perf_counter_ns() - start
+    return (elapsed / (commands * count_edges((DATA_COMMAND,))), commands * 8 * 1e9 / elapsed)
+
+
+def calibrate(display, max_clock_hz:float = MAX_CLOCK_HZ, margin:float = 1.25, samples:int = 1000) -> BusTiming:
+    '''Measures the pin changes of a TM1640 (or MultiTM1640), sets its `sleep` function accordingly, and returns the BusTiming.
+
+    Parameters:
+    display: The display, it must not be used by another thread meanwhile
+    max_clock_hz: Maximum clock frequency of the chip
+    margin: Safety factor over the minimum interval between two pin changes
+    samples: How many pin changes to measure
+
+    After each pin change, the sleep function waits for the minimum interval minus the fastest pin change measured, so no two pin changes are ever closer than the minimum interval.
+    '''
+    min_interval_ns = round(1e9 / max_clock_hz / 2 * margin)
+    write_ns = measure_write_ns(display, samples)
+    wait_ns = max(0, min_interval_ns - write_ns)
+    display.sleep = busy_wait(wait_ns) if wait_ns else no_sleep
+    (edge_ns, bit_rate) = measure_bus(display)
+    if edge_ns < min_interval_ns:
+        # Impossible if the measurements are right, but the protocol must not break silently.
+        warnings.warn('The pin changes are {0:.0f}ns apart on average, faster than the minimum of {1}ns'.format(edge_ns, min_interval_ns))
+    return BusTiming(
+        min_interval_ns=min_interval_ns,
+        write_ns=write_ns,
+        wait_ns=wait_ns,
+        edge_ns=edge_ns,
+        bit_rate=bit_rate,
+        # The fastest clock possible: a high and a low phase, each as short as the fastest pin change plus the wait.
+        max_clock_hz=1e9 / (2 * max(1, write_ns + wait_ns)),
+    )
@@ -0,0 +1,416 @@
+'''
+The carousel of views shown on the display.
+
+A view is a (callback, delay) tuple. The callback is a generator function that
+yields one or more frames, and each frame is either a str (passed to
+write_text) or bytes (passed to write_bytes). Each frame stays on the display
+for delay seconds.
+
+Views that collect data from somewhere that may stall (psutil, sysfs, the
+network...) can be marked as slow. With a SlowViewPool, they are computed in a
+worker thread with a timeout, and the last good frames are shown if the
+worker is late, so the other views (e.g. the clocks) never wait on them. On an
+asyncio loop, iterate_views_async() awaits the workers instead of blocking.
+
+Views whose output changes rarely can declare how long it stays valid (until
+the next second, minute, midnight...). With a ViewCache, their frames are
+rendered and encoded once, then reused until they expire.
+
+Views showing data pushed from outside (see datastore.py) can be marked as
+live, so the display daemon renders them again when the data changes while
+they are shown, instead of polling.
+'''
+
+import queue
+import segment7
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime, timedelta
+from functools import partial
+from time import perf_counter, time
+
+
+def _unwrap(callback):
+    while isinstance(callback, partial):
+        callback = callback.func
+    return callback
+
+
+def view_name(callback) -> str:
+    '''Returns a human-readable name for a view callback, looking through partial objects.'''
+    callback = _unwrap(callback)
+    return getattr(callback, '__name__', repr(callback))
+
+
+def view_attribute(callback, name:str, default=None):
+    '''Returns an attribute set by a decorator on a view callback, looking through partial objects (which may have the attribute themselves).'''
+    while isinstance(callback, partial):
+        if name in callback.__dict__:
+            return callback.__dict__[name]
+        callback = callback.func
+    return getattr(callback, name, default)
+
+
+def aligned(func):
+    '''Decorator for views whose frames must change at the wall-clock second edges (e.g. clocks).'''
+    func.aligned = True
+    return func
+
+
+def live(func):
+    '''Decorator for views showing pushed data, to be rendered again as soon as the data changes while they are on the display.
+
+    Their frames should be KeyedFrame objects, so the frame shown is replaced by the new frame for the same key, even if keys were added or removed in between. Otherwise, the new frame at the same position is shown.
+    '''
+    func.live = True
+    return func
+
+
+class KeyedFrame(str):
+    '''A frame (str) of a live view, tagged with the key of the data it shows.
+
+    >>> frame = KeyedFrame('temp 21.5', 'temp')
+    >>> (frame, frame.key)
+    ('temp 21.5', 'temp')
+    '''
+    def __new__(cls, text:str, key):
+        frame = super().__new__(cls, text)
+        frame.key = key
+        return frame
+
+
+def slow(timeout:float = 0.2):
+    '''Decorator for views that may stall, to be computed in a SlowViewPool with this timeout (in seconds).'''
+    def decorator(func):
+        func.slow = timeout
+        return func
+    return decorator
+
+
+def valid_until(policy):
+    '''Decorator for views whose output stays the same for a while, to be cached in a ViewCache.
+
+    The policy is a function from the current time to the time when the output may change (both as time.time() timestamps), such as next_second, next_minute or next_midnight. It can also be applied to a partial object, e.g. for a policy that depends on the arguments.
+    '''
+    def decorator(func):
+        func.valid_until = policy
+        return func
+    return decorator
+
+
+def next_second(now:float) -> float:
+    '''
+    >>> next_second(100.25)
+    101
+    '''
+    return int(now) + 1
+
+
+def next_minute(now:float) -> float:
+    '''
+    >>> next_minute(100.25)
+    120
+    '''
+    return (int(now) // 60 + 1) * 60
+
+
+def next_midnight(now:float) -> float:
+    '''The next local midnight.'''
+    tomorrow = datetime.fromtimestamp(now).date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day).timestamp()
+
+
+def valid_for(seconds:float):
+    '''Policy for an output that stays valid for a fixed amount of seconds.'''
+    return lambda now: now + seconds
+
+
+class ViewCache:
+    def __init__(self, maxsize:int = 64, clock=time, metrics=None):
+        '''
+        Parameters:
+        maxsize: How many views are cached at most; the least recently used is dropped first
+        clock: Wall clock, the same as the validity policies
+        metrics: Optional metrics.CarouselMetrics, to count the hits and misses per view
+        '''
+        self.maxsize = maxsize
+        self.clock = clock
+        self.metrics = metrics
+        # callback -> (expiry, frames), from the least to the most recently used.
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return 'ViewCache(size={0}, hits={1.hits}, misses={1.misses})'.format(len(self), self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, callback, now:float):
+        '''Returns the cached frames of a view, or None if there are none or they expired.'''
+        entry = self._entries.get(callback)
+        if entry is not None and now < entry[0]:
+            self._entries.move_to_end(callback)
+            self.hits += 1
+            if self.metrics is not None:
+                self.metrics.view_cache_hits.labels(view_name(callback)).inc()
+            return entry[1]
+        if entry is not None:
+            del self._entries[callback]
+        self.misses += 1
+        if self.metrics is not None:
+            self.metrics.view_cache_misses.labels(view_name(callback)).inc()
+        return None
+
+    def put(self, callback, frames, expiry:float):
+        self._entries[callback] = (expiry, frames)
+        self._entries.move_to_end(callback)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class SlowViewPool:
+    def __init__(self, max_workers:int = 2, max_wait:float = None, metrics=None):
+        '''
+        Parameters:
+        max_workers: How many slow views can be computed at the same time
+        max_wait: Upper limit for the timeouts of all views; 0 never waits
+        metrics: Optional metrics.CarouselMetrics, to count the timeouts per view
+        '''
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._closed = False
+        # Per callback: the running (or finished, not yet collected) future.
+        self._futures = {}
+        # Per callback: the last frames computed successfully.
+        self._results = {}
+        # (future, callback) to compute, None stops a worker.
+        self._tasks = queue.SimpleQueue()
+        # Daemon threads, unlike those of a ThreadPoolExecutor: a view stalled forever doesn't keep the process from exiting.
+        self._workers = [
+            threading.Thread(target=self._work, name='Slow view {0}'.format(i), daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        '''Stops the workers once they are done with the views already submitted, without waiting for them.'''
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            self._tasks.put(None)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            (future, callback) = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                frames = list(callback())
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(frames)
+            del task, future, callback
+
+    def _future(self, callback) -> Future:
+        '''Returns the future computing the frames of a view, submitting it if there is none running.'''
+        with self._lock:
+            future = self._futures.get(callback)
+            if future is None:
+                if self._closed:
+                    raise RuntimeError('The pool is closed')
+                # Only one worker per view, a stalled view doesn't pile up more.
+                future = self._futures[callback] = Future()
+                self._tasks.put((future, callback))
+            return future
+
+    def _collect(self, callback, future):
+        with self._lock:
+            if future.done():
+                del self._futures[callback]
+
+    def _late(self, callback):
+        if self.metrics is not None:
+            self.metrics.view_timeouts.labels(view_name(callback)).inc()
+        return (self._results.get(callback, []), False)
+
+    def frames(self, callback, timeout:float):
+        '''Returns the list of frames of a slow view, waiting at most timeout seconds for fresh ones.
+
+        If the worker is late, the last good frames are returned (an empty list if there are none yet), and the worker is left running; its result is used next time. Exceptions from the view are raised here.
+        '''
+        return self.render(callback, timeout)[0]
+
+    def render(self, callback, timeout:float):
+        '''Same as frames(), but returns (frames, fresh), where fresh is False if the worker was late.'''
+        if self.max_wait is not None:
+            timeout = min(timeout, self.max_wait)
+        future = self._future(callback)
+        try:
+            frames = future.result(timeout)
+        except TimeoutError:
+            return self._late(callback)
+        finally:
+            self._collect(callback, future)
+        self._results[callback] = frames
+        return (frames, True)
+
+    async def render_async(self, callback, timeout:float):
+        '''Same as render(), but awaits the worker instead of blocking the asyncio loop.'''
+        if self.max_wait is not None:
+            timeout = min(timeout, self.max_wait)
+        import asyncio
+        future = self._future(callback)
+        try:
+            # Shielded: a late worker is left running, its result is used next time.
+            frames = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return self._late(callback)
+        finally:
+            self._collect(callback, future)
+        self._results[callback] = frames
+        return (frames, True)
+
+
+def write_frame(display, frame):
+    '''Writes a frame (str or bytes) to the display.'''
+    if isinstance(frame, bytes):
+        display.write_bytes(frame)
+    elif isinstance(frame, str):
+        display.write_text(frame)
+    else:
+        raise TypeError('Expected str or bytes, received {!r}'.format(frame))
+
+
+def encode_frame(frame, width:int = 16) -> bytes:
+    '''Returns a frame (str or bytes) as the bytes that end up on the display, e.g. for the transitions.'''
+    if isinstance(frame, str):
+        frame = segment7.encode(frame)
+    elif not isinstance(frame, bytes):
+        raise TypeError('Expected str or bytes, received {!r}'.format(frame))
+    return frame[:width].ljust(width, b'\0')
+
+
+def _cached_frames(callback, cache):
+    '''Returns (policy, now, frames), where frames are the cached frames of the view, or None if they must be rendered.'''
+    policy = view_attribute(callback, 'valid_until') if cache is not None else None
+    if policy is None:
+        return (None, None, None)
+    # Taken before rendering, so the output is never considered valid for longer than it is.
+    now = cache.clock()
+    return (policy, now, cache.get(callback, now))
+
+
+def _cache_frames(callback, cache, policy, now, frames, fresh):
+    if policy is None:
+        return frames
+    frames = [encode_frame(frame) for frame in frames]
+    if fresh:
+        cache.put(callback, frames, policy(now))
+    return frames
+
+
+def _view_frames(callback, pool, cache):
+    (policy, now, frames) = _cached_frames(callback, cache)
+    if frames is not None:
+        return frames
+    timeout = view_attribute(callback, 'slow')
+    if pool is None or timeout is None:
+        (frames, fresh) = (callback(), True)
+    else:
+        (frames, fresh) = pool.render(callback, timeout)
+    return _cache_frames(callback, cache, policy, now, frames, fresh)
+
+
+async def _view_frames_async(callback, pool, cache):
+    (policy, now, frames) = _cached_frames(callback, cache)
+    if frames is not None:
+        return frames
+    timeout = view_attribute(callback, 'slow')
+    if pool is None or timeout is None:
+        (frames, fresh) = (callback(), True)
+    else:
+        (frames, fresh) = await pool.render_async(callback, timeout)
+    return _cache_frames(callback, cache, policy, now, frames, fresh)
+
+
+def iterate_views(views, metrics=None, pool=None, cache=None, on_error=None):
+    '''Endlessly yields (callback, frame, delay) for all the views, in order.
+
+    The frames are rendered lazily, only when the next one is requested. If pool (a SlowViewPool) is given, the views marked as slow are computed there, all their frames at once. If cache (a ViewCache) is given, the frames of the views with a validity are encoded and reused until they expire.
+
+    If metrics (a metrics.CarouselMetrics) is given, the time to render each frame is recorded per view.
+
+    If on_error is given, a view raising an exception doesn't stop the carousel: on_error(callback, exception) is called, and the carousel goes on with the next view. If a whole round of the views fails without a single frame, the last error is raised anyway, instead of spinning.
+    '''
+    while True:
+        shown = False
+        error = None
+        for (callback, delay) in views:
+            histogram = metrics.render_seconds.labels(view_name(callback)) if metrics is not None else None
+            try:
+                start = perf_counter()
+                for frame in _view_frames(callback, pool, cache):
+                    if histogram is not None:
+                        histogram.observe(perf_counter() - start)
+                    shown = True
+                    yield (callback, frame, delay)
+                    start = perf_counter()
+            except Exception as e:
+                if on_error is None:
+                    raise
+                error = e
+                if metrics is not None:
+                    metrics.view_errors.labels(view_name(callback)).inc()
+                on_error(callback, e)
+        if error is not None and not shown:
+            raise error
+
+
+async def iterate_views_async(views, metrics=None, pool=None, cache=None, on_error=None):
+    '''Same as iterate_views(), as an asynchronous generator: the slow views are awaited (see SlowViewPool.render_async()), instead of blocking the asyncio loop.'''
+    while True:
+        shown = False
+        error = None
+        for (callback, delay) in views:
+            histogram = metrics.render_seconds.labels(view_name(callback)) if metrics is not None else None
+            try:
+                start = perf_counter()
+                for frame in await _view_frames_async(callback, pool, cache):
+                    if histogram is not None:
+                        histogram.observe(perf_counter() - start)
+                    shown = True
+                    yield (callback, frame, delay)
+                    start = perf_counter()
+            except Exception as e:
+                if on_error is None:
+                    raise
+                error = e
+                if metrics is not None:
+                    metrics.view_errors.labels(view_name(callback)).inc()
+                on_error(callback, e)
+        if error is not None and not shown:
+            raise error
@@ -0,0 +1,68 @@
+'''
+Renders clock frames directly as bytes, from cached glyphs.
+
+Instead of formatting a string with strftime and encoding all 16 characters
+through segment7 every second, the encoded digit pairs 00-59 and the animated
+dashes are computed once. Each frame patches only the positions that changed
+since the previous frame; the date part is formatted and encoded once a day.
+'''
+
+import segment7
+
+
+# The length of this string must be a divisor of 60.
+DASHES = '_-‾-'
+
+# Encoded two-digit numbers, from 00 to 59.
+PAIRS = tuple(segment7.encode('{:02d}'.format(i)) for i in range(60))
+ENCODED_DASHES = tuple(segment7.encode(c) for c in DASHES)
+
+
+class ClockRenderer:
+    def __init__(self, prefix:str = '', suffix:str = '', date_format:str = '', width:int = 16):
+        '''
+        Renders frames looking like: prefix + 'HH:MM:SS' + suffix + now.strftime(date_format), where ':' are the animated dashes.
+
+        Parameters:
+        prefix: Text before the time
+        suffix: Text after the time
+        date_format: strftime format after the suffix, re-encoded only when the date changes
+        width: How many digits the display has
+        '''
+        self.width = width
+        self.date_format = date_format
+        self._head = segment7.encode(prefix)
+        self._tail = segment7.encode(suffix)
+        # Offset of the time inside the frame.
+        self._offset = len(self._head)
+        self._frame = None
+        self._date = None
+        self._hour = None
+        self._minute = None
+
+    def _layout(self, now):
+        date_part = segment7.encode(now.strftime(self.date_format)) if self.date_format else b''
+        frame = self._head + bytes(8) + self._tail + date_part
+        self._frame = bytearray(frame.ljust(self.width, b'\0'))
+        self._date = now.date()
+        self._hour = None
+        self._minute = None
+
+    def render(self, now) -> bytes:
+        '''Returns the frame for the given datetime.'''
+        if self._date != now.date():
+            self._layout(now)
+        frame = self._frame
+        i = self._offset
+        if now.hour != self._hour:
+            frame[i:i + 2] = PAIRS[now.hour]
+            self._hour = now.hour
+        if now.minute != self._minute:
+            frame[i + 3:i + 5] = PAIRS[now.minute]
+            self._minute = now.minute
+        dash = ENCODED_DASHES[now.second % len(DASHES)]
+        frame[i + 2:i + 3] = dash
+        frame[i + 5:i + 6] = dash
+        frame[i + 6:i + 8] = PAIRS[now.second]
+        # The frame may be longer than the display, in which case the time is cut off.
+        return bytes(frame[:self.width])
@@ -0,0 +1,209 @@
+'''
+Layered frame compositor, in front of a TM1640.
+
+The display shows a stack of layers: the background (e.g. the carousel),
+overlays (e.g. a status digit pinned in a corner) and alerts (e.g. an urgent
+notification flashed over everything). Each layer covers only some digits,
+has a priority, and may expire after a while. For each digit, the layer with
+the highest priority covering it wins.
+
+The layers are merged into a single frame only when one of them changes (or
+expires), and the frame is only written to the display if it is different
+from the previous one. All methods are thread-safe, so several producers can
+write to their layers concurrently; the frames are merged and written under
+a lock, so a frame never mixes half of one write with half of another.
+
+The Compositor itself has the same interface as TM1640 (write_text,
+write_bytes, brightness...), writing to the background layer, so it can be
+used wherever a display is expected.
+'''
+
+import segment7
+import threading
+from time import monotonic
+
+
+# Priorities of the usual layers.
+BACKGROUND = 0
+OVERLAY = 10
+ALERT = 20
+
+
+class Layer:
+    '''A layer of a Compositor, see Compositor.layer().'''
+    def __init__(self, compositor, name:str, priority:int):
+        self.compositor = compositor
+        self.name = name
+        self.priority = priority
+        self.frame = bytearray(compositor.width)
+        # Which digits this layer covers.
+        self.mask = [False] * compositor.width
+        # Monotonic time when this layer stops being shown, or None.
+        self.expires = None
+
+    def __repr__(self):
+        return 'Layer({0.name!r}, priority={0.priority})'.format(self)
+
+    def active(self, now:float) -> bool:
+        return any(self.mask) and (self.expires is None or now < self.expires)
+
+    def write_bytes(self, payload:bytes, address:int = 0, duration:float = None, mask=None) -> int:
+        '''Writes the payload into this layer, starting at address.
+
+        Parameters:
+        payload: The bytes for the digits
+        address: The first digit
+        duration: After how many seconds the layer disappears; None means never
+        mask: Sequence of booleans, which digits this layer covers; by default, the digits written by the payload
+
+        Returns how many bytes were actually sent to the display.
+        '''
+        compositor = self.compositor
+        width = compositor.width
+        if not 0 <= address < width:
+            raise ValueError('The address must be between 0 and {0}, received {1}'.format(width - 1, address))
+        payload = bytes(payload[:width - address])
+        if mask is None:
+            mask = [address <= i < address + len(payload) for i in range(width)]
+        elif len(mask) != width:
+            raise ValueError('The mask must have {0} items, received {1}'.format(width, len(mask)))
+        with compositor._lock:
+            self.frame[address:address + len(payload)] = payload
+            self.mask = [bool(m) for m in mask]
+            self.expires = None if duration is None else compositor.clock() + duration
+            return compositor._merge()
+
+    def write_text(self, text:str, address:int = 0, duration:float = None, mask=None) -> int:
+        '''Same as write_bytes(), but for a text; like TM1640.write_text(), it covers the digits up to the end of the display.'''
+        size = self.compositor.width - address
+        return self.write_bytes(segment7.encode(text)[:size].ljust(size, b'\0'), address, duration, mask)
+
+    def clear(self) -> int:
+        '''Removes this layer from the display.'''
+        compositor = self.compositor
+        with compositor._lock:
+            self.mask = [False] * compositor.width
+            self.expires = None
+            return compositor._merge()
+
+
+class Compositor:
+    def __init__(self, display, width:int = 16, clock=monotonic):
+        '''
+        Parameters:
+        display: A TM1640 (or ThreadedTM1640, or MultiTM1640)
+        width: How many digits the display has
+        clock: Monotonic clock for the expiry times
+        '''
+        self.display = display
+        self.width = width
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._layers = {}
+        # The last merged frame written to the display.
+        self.frame = None
+        self._pending_brightness = None
+        self._timer = None
+        self._timer_expiry = None
+        self.background = self.layer('background', BACKGROUND)
+        self.background.mask = [True] * width
+
+    def __repr__(self):
+        return 'Compositor({0.display!r})'.format(self)
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        '''Stops the expiry timer. The display is not closed, it belongs to whoever created it.'''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def layer(self, name:str, priority:int = OVERLAY) -> Layer:
+        '''Returns the layer with this name, creating it with this priority if needed.'''
+        with self._lock:
+            layer = self._layers.get(name)
+            if layer is None:
+                layer = self._layers[name] = Layer(self, name, priority)
+            return layer
+
+    def layers(self):
+        '''Returns all the layers, from the lowest to the highest priority.'''
+        with self._lock:
+            return sorted(self._layers.values(), key=lambda layer: layer.priority)
+
+    def _merge(self) -> int:
+        # Must be called with the lock held.
+        now = self.clock()
+        frame = bytearray(self.width)
+        next_expiry = None
+        for layer in self.layers():
+            if not layer.active(now):
+                continue
+            for (i, covered) in enumerate(layer.mask):
+                if covered:
+                    frame[i] = layer.frame[i]
+            if layer.expires is not None and (next_expiry is None or layer.expires < next_expiry):
+                next_expiry = layer.expires
+        self._schedule(next_expiry, now)
+        sent = 0
+        frame = bytes(frame)
+        if frame != self.frame:
+            self.frame = frame
+            if self._pending_brightness is not None:
+                self.display.defer_brightness(self._pending_brightness)
+            sent = self.display.write_bytes(frame)
+        elif self._pending_brightness is not None:
+            # No frame to carry the brightness, it is sent alone.
+            self.display.brightness = self._pending_brightness
+        self._pending_brightness = None
+        return sent
+
+    def _schedule(self, expiry, now:float):
+        '''Sets up a timer to merge the layers again when the next layer expires.'''
+        if self._timer is not None:
+            if expiry == self._timer_expiry:
+                return
+            self._timer.cancel()
+            self._timer = None
+        self._timer_expiry = expiry
+        if expiry is not None:
+            self._timer = threading.Timer(max(0, expiry - now), self._expired)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expired(self):
+        with self._lock:
+            self._timer = None
+            self._merge()
+
+    # Same interface as TM1640, on the background layer.
+    def write_bytes(self, payload:bytes, address:int = 0) -> int:
+        return self.background.write_bytes(payload, address, mask=self.background.mask)
+
+    def write_text(self, text:str, address:int = 0) -> int:
+        return self.background.write_text(text, address, mask=self.background.mask)
+
+    @property
+    def brightness(self):
+        return self.display.brightness
+
+    @property
+    def frames_written(self):
+        return self.display.frames_written
+
+    @brightness.setter
+    def brightness(self, value):
+        with self._lock:
+            self._pending_brightness = None
+            self.display.brightness = value
+
+    def defer_brightness(self, value):
+        '''Same as TM1640.defer_brightness(): the brightness is sent with the next merged frame.'''
+        with self._lock:
+            self._pending_brightness = value
@@ -0,0 +1,155 @@
+'''
+In-memory store for the values pushed by external systems.
+
+Home Assistant, a weather service or any script can POST keyed values to the
+display daemon (see POST /data in display_daemon.py), instead of the views
+polling them. Fetching them from inside the carousel would stall the clock
+whenever a server is slow; with the store, the views only read from memory.
+
+Updates are coalesced per key: only the latest value is kept, however fast
+the updates come, and nothing is rendered or sent to the display when a value
+arrives. The views pick the new values up on their next frame. Each value has
+a time to live, so a source that stops pushing doesn't leave stale data on
+the display forever.
+
+Listeners can be notified of each batch, e.g. to render a view again while
+it shows the data; they should coalesce the notifications themselves.
+'''
+
+import threading
+from time import monotonic
+
+
+class _Entry:
+    __slots__ = ('value', 'updated', 'expires', 'read')
+
+    def __init__(self, value, updated:float, expires:float):
+        self.value = value
+        self.updated = updated
+        self.expires = expires
+        # Whether a view has read this value; overwriting an unread value is a coalesced update.
+        self.read = False
+
+
+class DataStore:
+    def __init__(self, ttl:float = 600, max_keys:int = 256, clock=monotonic):
+        '''
+        Parameters:
+        ttl: Default amount of seconds a value is kept after its last update
+        max_keys: Maximum amount of live keys, so a misbehaving client can't fill up the memory
+        clock: Monotonic clock for the expiry times
+        '''
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Functions called with the updated keys after each batch, see add_listener().
+        self._listeners = []
+        # Counters, see stats().
+        self.batches = 0
+        self.updates = 0
+        self.coalesced = 0
+        self.expired = 0
+
+    def __repr__(self):
+        return 'DataStore(keys={0})'.format(len(self._entries))
+
+    def update(self, values, ttl:float = None) -> int:
+        '''Stores a batch of values, a dict (or iterable of pairs) of key to value; None removes the key. Returns how many keys were updated.
+
+        Raises ValueError, without storing anything, if a key is not a non-empty string, or if there would be more than max_keys live keys.
+        '''
+        values = dict(values)
+        for key in values:
+            if not isinstance(key, str) or not key:
+                raise ValueError('The keys must be non-empty strings, received {!r}'.format(key))
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            now = self.clock()
+            stored = {key for (key, value) in values.items() if value is not None}
+            new_keys = stored - self._entries.keys()
+            if new_keys and len(self._entries) + len(new_keys) > self.max_keys:
+                self._purge(now)
+                new_keys = stored - self._entries.keys()
+                if len(self._entries) + len(new_keys) > self.max_keys:
+                    raise ValueError('Too many keys, the maximum is {0}'.format(self.max_keys))
+            entries = self._entries
+            for (key, value) in values.items():
+                entry = entries.get(key)
+                if entry is not None and not entry.read and entry.expires > now:
+                    self.coalesced += 1
+                if value is None:
+                    entries.pop(key, None)
+                else:
+                    entries[key] = _Entry(value, now, now + ttl)
+            self.batches += 1
+            self.updates += len(values)
+            listeners = list(self._listeners)
+        keys = list(values)
+        for listener in listeners:
+            listener(keys)
+        return len(values)
+
+    def add_listener(self, listener):
+        '''Calls listener(keys) after each batch, from the thread that stored it; it must return quickly.'''
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def _purge(self, now:float):
+        # Must be called with the lock held.
+        expired = [key for (key, entry) in self._entries.items() if entry.expires <= now]
+        for key in expired:
+            del self._entries[key]
+        self.expired += len(expired)
+
+    def get(self, key:str, default=None):
+        '''Returns the latest value of key, or default if it is missing or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires <= self.clock():
+                return default
+            entry.read = True
+            return entry.value
+
+    def age(self, key:str):
+        '''Returns how many seconds ago key was last updated, or None if it is missing or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry is None or entry.expires <= now:
+                return None
+            return now - entry.updated
+
+    def items(self):
+        '''Returns a list of (key, value) for all the live keys, sorted by key.'''
+        with self._lock:
+            now = self.clock()
+            self._purge(now)
+            items = sorted(self._entries.items())
+            for (key, entry) in items:
+                entry.read = True
+            return [(key, entry.value) for (key, entry) in items]
+
+    def delete(self, key:str) -> bool:
+        '''Removes key right away. Returns whether it was live.'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry is not None and entry.expires > self.clock()
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            return {
+                'keys': sum(1 for entry in self._entries.values() if entry.expires > now),
+                'batches': self.batches,
+                'updates': self.updates,
+                # Updates overwritten before any view read them.
+                'coalesced': self.coalesced,
+                'expired': self.expired,
+            }
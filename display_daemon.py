@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+'''
+Display daemon: runs the carousel of views and an HTTP API on the same asyncio loop.
+
+HTTP API (all POST requests take the value in the request body):
+* POST /text       Shows the text right away. The carousel is held for `hold` seconds (query parameter, default 10). Texts longer than the display scroll once, then are held.
+* POST /bytes      Same as /text, but the body is the raw payload (up to 16 bytes).
+* POST /alert      Shows the text over everything for `duration` seconds (default 5), without holding the carousel. An empty body removes it.
+* POST /overlay    Pins the text at digit `address` (default 0) over the carousel, for `duration` seconds (default forever). An empty body removes it.
+* POST /pause      Stops the carousel, the current frame stays on the display.
+* POST /resume     Resumes the carousel right away.
+* POST /brightness Sets the brightness (0 to 8). With the `fade` query parameter, fades to it over that many seconds.
+* POST /data       Stores a batch of values pushed by external systems, a JSON object of key to value (null removes the key). They expire after `ttl` seconds (default 600), and are shown by the carousel; nothing is sent to the display right away.
+* GET  /status     Returns the daemon state as JSON.
+* GET  /metrics    Returns the runtime metrics in the Prometheus text format.
+* GET  /ws         WebSocket: streams every frame sent to the display (a brightness byte, then the frame bytes), and shows the frames pushed by the client (binary or text messages, like /bytes and /text).
+* GET  /           A page mirroring the display live, through /ws.
+'''
+
+import asyncio
+import logging
+import os
+import segment7
+import signal
+from aiohttp import web
+from contextlib import AsyncExitStack
+from aiohttp_experiment import WebApp
+from carousel import SlowViewPool, ViewCache, encode_frame, iterate_views_async, view_attribute, view_name, write_frame
+from compositor import ALERT, OVERLAY, Compositor
+from datastore import DataStore
+from fade import Fader
+from interfaces import InterfaceCache
+from ip_addresses import build_sampler, build_views
+from marquee import Marquee
+from scheduler import FrameScheduler, IdleMeter
+from metrics import CarouselMetrics, DisplayMetrics, Registry
+from tm1640 import ThreadedTM1640
+from transitions import Transition
+from websocket_mirror import WebSocketMirror
+
+
+logger = logging.getLogger(__name__)
+
+
+class DisplayDaemon:
+    def __init__(self, display, views, hold:float = 10, marquee_fps:float = 4, transition:str = 'slide', transition_fps:float = 50, pool=None, cache=None, store=None, data_refresh:float = 0.2, metrics=None):
+        '''
+        Parameters:
+        display: A TM1640 (or ThreadedTM1640, so GPIO never blocks the loop), or a Compositor in front of it, for the alerts and overlays
+        views: List of (callback, delay), see carousel.py
+        hold: Default amount of seconds a pushed frame stays before the carousel continues
+        marquee_fps: Scrolling speed for pushed texts longer than the display
+        transition: Effect between two views (see transitions.EFFECTS), or None
+        transition_fps: Target frame rate of the transitions
+        pool: Optional carousel.SlowViewPool for the views marked as slow; the loop keeps running while they are awaited
+        cache: Optional carousel.ViewCache for the views that declare a validity
+        store: Optional datastore.DataStore; while a live view is shown, it is rendered again when the store is updated
+        data_refresh: Minimum amount of seconds between two renderings of a live view, however fast the store is updated
+        metrics: Optional metrics.CarouselMetrics
+        '''
+        self.display = display
+        self.views = views
+        self.pool = pool
+        self.cache = cache
+        self.metrics = metrics
+        self.scheduler = FrameScheduler(metrics=metrics)
+        self.hold = hold
+        self.marquee_fps = marquee_fps
+        self._marquee = None
+        self.transition = transition
+        self.transition_fps = transition_fps
+        self._transition_task = None
+        # TransitionStats of the last transition.
+        self.last_transition = None
+        # bus_timing.BusTiming of the display, if it was calibrated.
+        self.bus_timing = None
+        self._loop = asyncio.get_running_loop()
+        # The fade steps are deferred to the carousel frames when possible.
+        self.fader = Fader(display, clock=self._loop.time)
+        self._fade = None
+        self.paused = False
+        self.frame = None
+        # Monotonic time until which the carousel must not overwrite a pushed frame.
+        self._hold_until = 0
+        # Set whenever the API changes something, so the carousel wakes up right away.
+        self._wakeup = asyncio.Event()
+        # Wakeups and CPU time, to check that idling is cheap.
+        self.idle = IdleMeter(clock=self._loop.time)
+        # The live view on the display, as (callback, key of its frame, index of its frame), or None.
+        self._live = None
+        self.data_refresh = data_refresh
+        self._refresh = False
+        self._poked = False
+        self._refresh_handle = None
+        self._refreshed_at = 0
+        if store is not None:
+            store.add_listener(self._data_changed)
+
+    def _poke(self):
+        self._poked = True
+        self._wakeup.set()
+
+    async def _sleep(self, delay:float) -> bool:
+        '''Sleeps for delay seconds, or until the API pokes the carousel (or a live view must be rendered again). Returns False if woken up early.'''
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    def _data_changed(self, keys):
+        # DataStore listener, possibly called from another thread.
+        if self._live is not None and self._refresh_handle is None:
+            self._loop.call_soon_threadsafe(self._schedule_refresh)
+
+    def _schedule_refresh(self):
+        # Coalesces the updates: at most one rendering of the live view every data_refresh seconds.
+        if self._live is None or self._refresh_handle is not None:
+            return
+        when = max(self._loop.time(), self._refreshed_at + self.data_refresh)
+        self._refresh_handle = self._loop.call_at(when, self._refresh_live)
+
+    def _refresh_live(self):
+        self._refresh_handle = None
+        if self._live is None:
+            return
+        self._refreshed_at = self._loop.time()
+        self._refresh = True
+        self._wakeup.set()
+
+    def _render_live(self):
+        '''Renders the live view on the display again, and writes its frame if it changed.'''
+        (callback, key, index) = self._live
+        frames = list(callback())
+        if key is not None:
+            # The frame for the same data; none if the key is gone, then the frame shown stays until its deadline.
+            frames = [frame for frame in frames if getattr(frame, 'key', None) == key]
+            index = 0
+        if index < len(frames) and frames[index] != self.frame:
+            write_frame(self.display, frames[index])
+            self.frame = frames[index]
+
+    def _stop_marquee(self):
+        if self._marquee is not None:
+            self._marquee.cancel()
+            self._marquee = None
+        # A pushed frame also interrupts a transition of the carousel.
+        if self._transition_task is not None:
+            self._transition_task.cancel()
+
+    def show(self, frame, hold=None):
+        '''Shows a frame (str or bytes) right away and holds the carousel for a while.
+
+        A text longer than the display scrolls once, and the hold starts after that.
+        '''
+        self._stop_marquee()
+        if hold is None:
+            hold = self.hold
+        if isinstance(frame, str) and len(segment7.encode(frame)) > 16:
+            marquee = Marquee(frame)
+            self._marquee = asyncio.create_task(marquee.play_async(self.display, self.marquee_fps))
+            hold += len(marquee) / self.marquee_fps
+        else:
+            write_frame(self.display, frame)
+        self.frame = frame
+        loop = asyncio.get_running_loop()
+        self._hold_until = loop.time() + hold
+        self._poke()
+
+    def fade(self, level:int, duration:float):
+        '''Fades to the brightness level over duration seconds, without holding the carousel.'''
+        if self._fade is not None:
+            self._fade.cancel()
+            self._fade = None
+        self.fader.fade_to(level, duration)
+        if self.fader.fading:
+            self._fade = asyncio.create_task(self.fader.run_async())
+
+    def pause(self):
+        self.paused = True
+        self._poke()
+
+    def resume(self):
+        self._stop_marquee()
+        self.paused = False
+        self._hold_until = 0
+        self._poke()
+
+    async def _transition(self, old:bytes, new:bytes) -> bool:
+        '''Plays a transition between two views. Returns False if it was interrupted by a pushed frame.'''
+        transition = Transition(old, new, self.transition, fps=self.transition_fps)
+        task = self._transition_task = asyncio.create_task(transition.play_async(self.display))
+        try:
+            # Unlike awaiting the task, this doesn't raise if the task is cancelled.
+            await asyncio.wait([task])
+        finally:
+            # In case the carousel itself is cancelled.
+            task.cancel()
+            self._transition_task = None
+        if task.cancelled():
+            return False
+        stats = task.result()
+        self.last_transition = stats
+        if self.metrics is not None:
+            self.metrics.transition_fps.labels(stats.effect).observe(stats.fps)
+        return True
+
+    def _view_failed(self, callback, exception):
+        logger.error('The view %s failed, skipping it', view_name(callback), exc_info=exception)
+
+    async def run_carousel(self):
+        '''Runs the carousel until cancelled. A view raising an exception is logged and skipped.'''
+        try:
+            await self._run_carousel()
+        except Exception:
+            # E.g. all the views fail: the display would stay frozen on the last frame.
+            logger.exception('The carousel has stopped')
+            raise
+
+    async def _run_carousel(self):
+        loop = asyncio.get_running_loop()
+        frames = iterate_views_async(self.views, self.metrics, self.pool, self.cache, on_error=self._view_failed)
+        try:
+            await self._carousel_loop(loop, frames)
+        finally:
+            await frames.aclose()
+
+    async def _carousel_loop(self, loop, frames):
+        scheduler = self.scheduler
+        # The last view shown by the carousel, and its last frame (encoded).
+        previous = (None, None)
+        # Index of the frame within its view.
+        index = 0
+        while True:
+            if self.paused:
+                await self._sleep(None)
+                scheduler.reset()
+                continue
+            remaining = self._hold_until - loop.time()
+            if remaining > 0:
+                await self._sleep(remaining)
+                scheduler.reset()
+                # The next view comes in from the pushed frame.
+                previous = (None, encode_frame(self.frame))
+                continue
+            (callback, frame, delay) = await frames.__anext__()
+            (previous_callback, previous_frame) = previous
+            index = index + 1 if callback is previous_callback else 0
+            encoded = encode_frame(frame)
+            aligned = view_attribute(callback, 'aligned', False)
+            # An aligned view (a clock) is due on the second, and rendering it early enough for a transition would show the previous second: it just cuts in.
+            if self.transition and not aligned and callback is not previous_callback and previous_frame is not None:
+                if not await self._transition(previous_frame, encoded):
+                    continue
+            write_frame(self.display, frame)
+            self.frame = frame
+            previous = (callback, encoded)
+            deadline = scheduler.next_deadline(delay, aligned)
+            # Nothing else changes the output until the deadline: the carousel sleeps until then, unless the data shown is updated.
+            self._live = (callback, getattr(frame, 'key', None), index) if view_attribute(callback, 'live', False) else None
+            try:
+                while True:
+                    self._refresh = self._poked = False
+                    if await self._sleep(deadline - scheduler.clock()):
+                        scheduler.frame_started()
+                        break
+                    if self._poked and (self.paused or self._hold_until > loop.time()):
+                        # A pushed frame or a pause takes over.
+                        break
+                    if self._refresh:
+                        self._render_live()
+                    # Otherwise, nothing changed for the carousel (e.g. resume() while not paused): the current frame keeps its deadline.
+            finally:
+                self._live = None
+                if self._refresh_handle is not None:
+                    self._refresh_handle.cancel()
+                    self._refresh_handle = None
+
+    def layer(self, name:str, priority:int):
+        '''Returns a layer of the compositor.'''
+        if not isinstance(self.display, Compositor):
+            raise RuntimeError('Layers need a Compositor as the display')
+        return self.display.layer(name, priority)
+
+    async def goodbye(self):
+        self._stop_marquee()
+        if isinstance(self.display, Compositor):
+            for layer in self.display.layers():
+                if layer is not self.display.background:
+                    layer.clear()
+        self.display.write_text('GOODBYE...')
+        self.fade(0, duration=1)
+        await asyncio.sleep(1)
+        self.display.write_text('')
+        # Stops the fade, sending its last step if it wasn't sent yet.
+        self.fade(0, duration=0)
+
+
+# The page served at /.
+MIRROR_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mirror.html')
+
+# Largest body accepted by POST /data, so parsing a batch never blocks the loop for long.
+MAX_DATA_BYTES = 64 * 1024
+
+
+class DaemonWebApp(WebApp):
+    def __init__(self, daemon, registry=None, host='0.0.0.0', port=8080, mirror=None, store=None):
+        super().__init__(host, port)
+        self.daemon = daemon
+        self.registry = registry
+        self.mirror = mirror
+        self.store = store
+        if store is not None:
+            self.app.add_routes([
+                web.post('/data', self.post_data),
+            ])
+        if mirror is not None:
+            self.app.add_routes([
+                web.get('/ws', mirror.handle),
+                web.get('/', self.get_mirror_page),
+            ])
+        self.app.add_routes([
+            web.post('/text', self.post_text),
+            web.post('/bytes', self.post_bytes),
+            web.post('/alert', self.post_alert),
+            web.post('/overlay', self.post_overlay),
+            web.post('/pause', self.post_pause),
+            web.post('/resume', self.post_resume),
+            web.post('/brightness', self.post_brightness),
+            web.get('/status', self.get_status),
+            web.get('/metrics', self.get_metrics),
+        ])
+
+    @staticmethod
+    def _number(request, name:str, default, parse=float):
+        text = request.query.get(name)
+        if text is None:
+            return default
+        try:
+            return parse(text)
+        except ValueError:
+            raise web.HTTPBadRequest(text='Invalid {0}: {1!r}'.format(name, text))
+
+    async def post_text(self, request):
+        hold = self._number(request, 'hold', None)
+        self.daemon.show(await request.text(), hold)
+        return web.Response(text='OK')
+
+    async def post_bytes(self, request):
+        hold = self._number(request, 'hold', None)
+        payload = await request.read()
+        if len(payload) > 16:
+            raise web.HTTPBadRequest(text='The payload must be at most 16 bytes, received {0} bytes'.format(len(payload)))
+        self.daemon.show(payload, hold)
+        return web.Response(text='OK')
+
+    async def post_alert(self, request):
+        duration = self._number(request, 'duration', 5.0)
+        text = await request.text()
+        layer = self.daemon.layer('alert', ALERT)
+        if text:
+            layer.write_text(text, duration=duration)
+        else:
+            layer.clear()
+        return web.Response(text='OK')
+
+    async def post_overlay(self, request):
+        duration = self._number(request, 'duration', None)
+        address = self._number(request, 'address', 0, int)
+        if not 0 <= address < 16:
+            raise web.HTTPBadRequest(text='The address must be between 0 and 15, received {0}'.format(address))
+        text = await request.text()
+        layer = self.daemon.layer('overlay', OVERLAY)
+        if text:
+            # Only the digits of the text are covered, the carousel stays visible around them.
+            encoded = segment7.encode(text)[:16 - address]
+            layer.write_bytes(encoded, address, duration=duration)
+        else:
+            layer.clear()
+        return web.Response(text='OK')
+
+    async def post_pause(self, request):
+        self.daemon.pause()
+        return web.Response(text='OK')
+
+    async def post_resume(self, request):
+        self.daemon.resume()
+        return web.Response(text='OK')
+
+    async def post_brightness(self, request):
+        duration = self._number(request, 'fade', 0.0)
+        text = await request.text()
+        try:
+            value = int(text)
+        except ValueError:
+            raise web.HTTPBadRequest(text='Invalid brightness: {!r}'.format(text))
+        self.daemon.fade(value, duration)
+        return web.Response(text='OK')
+
+    async def post_data(self, request):
+        if request.content_length is not None and request.content_length > MAX_DATA_BYTES:
+            raise web.HTTPRequestEntityTooLarge(max_size=MAX_DATA_BYTES, actual_size=request.content_length)
+        ttl = self._number(request, 'ttl', None)
+        if ttl is not None and ttl <= 0:
+            raise web.HTTPBadRequest(text='The ttl must be positive, received {0}'.format(ttl))
+        try:
+            values = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='The body must be a JSON object')
+        if not isinstance(values, dict):
+            raise web.HTTPBadRequest(text='The body must be a JSON object, received {0}'.format(type(values).__name__))
+        for (key, value) in values.items():
+            if isinstance(value, (dict, list)):
+                raise web.HTTPBadRequest(text='The values must be strings, numbers, booleans or null, received {0} for {1!r}'.format(type(value).__name__, key))
+        try:
+            count = self.store.update(values, ttl)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response({'updated': count})
+
+    async def get_status(self, request):
+        frame = self.daemon.frame
+        transition = self.daemon.last_transition
+        display = self.daemon.display
+        timing = self.daemon.bus_timing
+        layers = None
+        if isinstance(display, Compositor):
+            now = display.clock()
+            layers = [
+                {
+                    'name': layer.name,
+                    'priority': layer.priority,
+                    'active': layer.active(now),
+                    'expires_in': None if layer.expires is None else max(0, layer.expires - now),
+                }
+                for layer in display.layers()
+            ]
+        return web.json_response({
+            'paused': self.daemon.paused,
+            'brightness': self.daemon.display.brightness,
+            'frame': frame.hex() if isinstance(frame, bytes) else frame,
+            'lateness': self.daemon.scheduler.report(),
+            'last_transition': transition._asdict() if transition is not None else None,
+            'layers': layers,
+            'view_cache': self.daemon.cache.stats() if self.daemon.cache is not None else None,
+            'idle': self.daemon.idle.report(),
+            'data': self.store.stats() if self.store is not None else None,
+            'mirror': {'clients': len(self.mirror.clients), 'dropped': self.mirror.dropped} if self.mirror is not None else None,
+            'bus_timing': timing._asdict() if timing is not None else None,
+            'display': display.frame.hex() if isinstance(display, Compositor) and display.frame is not None else None,
+        })
+
+    async def get_mirror_page(self, request):
+        return web.FileResponse(MIRROR_PAGE)
+
+    async def get_metrics(self, request):
+        if self.registry is None:
+            raise web.HTTPNotFound(text='Metrics are disabled')
+        return web.Response(
+            body=self.registry.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+
+async def _stop_task(task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        # Already logged by the task itself; the shutdown must go on.
+        pass
+
+
+async def async_main(host='0.0.0.0', port=8080):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    # Everything is released in the reverse order, even if one of the steps fails.
+    async with AsyncExitStack() as stack:
+        sampler = stack.enter_context(build_sampler())
+        sampler.start(interval=5)
+        interfaces = stack.enter_context(InterfaceCache())
+        # Values pushed through POST /data, the views only read them from memory.
+        store = DataStore()
+        views = build_views(sampler, interfaces, store)
+        registry = Registry()
+
+        # Every frame sent to the display also goes to the WebSocket clients.
+        mirror = WebSocketMirror(loop)
+
+        display = stack.enter_context(ThreadedTM1640(clk_pin=24, din_pin=23, metrics=DisplayMetrics(registry), outputs=[mirror]))
+        display.brightness = 1
+        timing = display.calibrate()
+        metrics = CarouselMetrics(registry)
+        # Slow views are awaited up to their own timeouts while the loop keeps serving the API; a late view shows its last frames.
+        pool = stack.enter_context(SlowViewPool(metrics=metrics))
+        # The carousel writes to the background layer, the alerts and overlays go over it.
+        compositor = stack.enter_context(Compositor(display))
+        daemon = DisplayDaemon(compositor, views, pool=pool, cache=ViewCache(metrics=metrics), store=store, metrics=metrics)
+        daemon.bus_timing = timing
+        stack.push_async_callback(daemon.goodbye)
+        # Frames pushed through the WebSocket are shown like POST /bytes and /text.
+        mirror.on_frame = daemon.show
+        # The HELLO frame is held like any other pushed frame.
+        daemon.show('{:^16}'.format('-- HELLO --'), hold=1)
+
+        webapp = DaemonWebApp(daemon, registry, host, port, mirror, store)
+        await webapp.run()
+        stack.push_async_callback(webapp.close)
+        # The WebSocket clients are disconnected first, or the web app would wait for them.
+        stack.push_async_callback(mirror.close)
+        carousel = asyncio.create_task(daemon.run_carousel())
+        stack.push_async_callback(_stop_task, carousel)
+        await stop.wait()
+
+
+def main():
+    asyncio.run(async_main())
+
+
+if __name__ == '__main__':
+    main()
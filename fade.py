@@ -0,0 +1,137 @@
+'''
+Brightness fades that don't block the text updates.
+
+A fade is precomputed as a list of (time, level) steps on the monotonic clock:
+the TM1640 only has 9 brightness levels, so a fade is at most 8 display
+control commands, evenly spaced over its duration. The steps are interleaved
+with the frames on the same schedule. A step due shortly before a frame is
+deferred and sent in the same burst as that frame, and a level that is
+already on the display is never sent again.
+'''
+
+from bisect import bisect_right
+from time import monotonic, sleep
+from tm1640 import clamp
+
+
+class Fade:
+    def __init__(self, start:int, end:int, duration:float, start_time:float):
+        '''
+        Parameters:
+        start: Brightness level at start_time
+        end: Brightness level at the end of the fade
+        duration: Duration of the fade, in seconds
+        start_time: Start of the fade, in monotonic clock time
+        '''
+        self.start = start
+        self.end = end
+        count = abs(end - start)
+        if count == 0 or duration <= 0:
+            self.times = (start_time,)
+            self.levels = (end,)
+        else:
+            direction = 1 if end > start else -1
+            self.times = tuple(start_time + duration * k / count for k in range(1, count + 1))
+            self.levels = tuple(start + direction * k for k in range(1, count + 1))
+
+    def __repr__(self):
+        return 'Fade({0.start}, {0.end}, steps={1})'.format(self, len(self.times))
+
+    def level_at(self, now:float) -> int:
+        '''Returns the brightness level at the given time.'''
+        i = bisect_right(self.times, now)
+        return self.start if i == 0 else self.levels[i - 1]
+
+    def next_step(self, now:float):
+        '''Returns the time of the first step after now, or None if the fade is over.'''
+        i = bisect_right(self.times, now)
+        return self.times[i] if i < len(self.times) else None
+
+
+class Fader:
+    def __init__(self, display, clock=monotonic, merge:float = 0.05):
+        '''
+        Parameters:
+        display: A TM1640 (or ThreadedTM1640, or MultiTM1640)
+        clock: Monotonic clock for the steps
+        merge: Steps due less than this many seconds before a frame are sent together with the frame
+        '''
+        self.display = display
+        self.clock = clock
+        self.merge = merge
+        self.fade = None
+        # Incremented by every fade_to(), so a replaced fade doesn't send its last step.
+        self._generation = 0
+
+    def __repr__(self):
+        return 'Fader({0.fade!r})'.format(self)
+
+    @property
+    def fading(self) -> bool:
+        return self.fade is not None
+
+    def fade_to(self, level:int, duration:float):
+        '''Starts a fade from the current brightness, replacing any fade in progress.'''
+        start = self.display.brightness
+        if start is None:
+            start = 0
+        self.fade = Fade(start, clamp(int(level), 0, 8), duration, self.clock())
+        self._generation += 1
+        # A zero-length fade is applied right away.
+        self.apply(self.clock())
+
+    def apply(self, now:float, deferred:bool = False):
+        '''Brings the display to the level of the fade at the given time.
+
+        If deferred, the level is only sent together with the next frame.
+        '''
+        fade = self.fade
+        if fade is None:
+            return
+        level = fade.level_at(now)
+        if fade.next_step(now) is None:
+            self.fade = None
+        if deferred:
+            self.display.defer_brightness(level)
+        else:
+            # Does nothing if the level is already on the display.
+            self.display.brightness = level
+
+    def sleep_until(self, deadline:float, sleep=sleep):
+        '''Sleeps until the deadline (in clock() time), sending the fade steps due in the meantime.
+
+        The steps due right before the deadline are left for the frame that follows.
+        '''
+        while self.fade is not None:
+            step = self.fade.next_step(self.clock())
+            if step is None or step >= deadline - self.merge:
+                break
+            sleep(max(0, step - self.clock()))
+            self.apply(step)
+        sleep(max(0, deadline - self.clock()))
+        self.apply(self.clock(), deferred=True)
+
+    def sleep(self, seconds:float):
+        '''Drop-in replacement for time.sleep(), e.g. for FrameScheduler.wait().'''
+        self.sleep_until(self.clock() + seconds)
+
+    async def run_async(self):
+        '''Plays the current fade on an asyncio loop (whose clock must be the same as this fader's).
+
+        Each step is first deferred to the next frame. If no frame was sent within `merge` seconds, it is sent alone.
+        '''
+        # Imported here: the synchronous carousel (ip_addresses.py) doesn't load asyncio at startup.
+        import asyncio
+        generation = self._generation
+        while self.fade is not None and generation == self._generation:
+            step = self.fade.next_step(self.clock())
+            if step is not None:
+                await asyncio.sleep(max(0, step - self.clock()))
+                if generation != self._generation:
+                    break
+            level = self.fade.level_at(self.clock())
+            self.apply(self.clock(), deferred=True)
+            await asyncio.sleep(self.merge)
+            if generation == self._generation:
+                # Does nothing if a frame already carried the level.
+                self.display.brightness = level
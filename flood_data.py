@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+Floods the POST /data endpoint of display_daemon.py, to check that pushed
+data doesn't disturb the display.
+
+It first watches the daemon for a while without sending anything, then sends
+batches of random values as fast as possible from several concurrent
+senders. For both phases, it reports the lateness of the carousel frames
+(from GET /status), so the frame timing with and without the flood can be
+compared, along with how many updates were accepted and coalesced.
+
+    ./display_daemon.py &
+    ./flood_data.py --seconds 10 --senders 8 --batch 20
+'''
+
+import argparse
+import asyncio
+import math
+import random
+import time
+
+import aiohttp
+
+from replay import percentile
+
+
+def phase_lateness(before, after):
+    '''Returns (frames, mean, stdev) of the frame lateness between two /status reports, from their running statistics.'''
+    count = after['count'] - before['count']
+    if count <= 0:
+        return (0, None, None)
+    def sums(stats):
+        # Sum and sum of squares, recovered from the count, mean and (population) stdev.
+        n = stats['count']
+        return (n * stats['mean'], n * (stats['stdev'] ** 2 + stats['mean'] ** 2))
+    (sum1, squares1) = sums(before)
+    (sum2, squares2) = sums(after)
+    mean = (sum2 - sum1) / count
+    variance = max(0.0, (squares2 - squares1) / count - mean ** 2)
+    return (count, mean, math.sqrt(variance))
+
+
+async def get_status(session, url:str):
+    async with session.get(url + '/status') as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def sender(session, url:str, deadline:float, keys, batch:int, ttl:float, latencies):
+    while time.monotonic() < deadline:
+        values = {key: round(random.uniform(-20, 40), 1) for key in random.sample(keys, batch)}
+        start = time.monotonic()
+        async with session.post(url + '/data', params={'ttl': str(ttl)}, json=values) as response:
+            response.raise_for_status()
+            await response.read()
+        latencies.append(time.monotonic() - start)
+
+
+async def run(url:str, seconds:float, senders:int, batch:int, key_count:int, ttl:float):
+    keys = ['flood{:02d}'.format(i) for i in range(key_count)]
+    batch = min(batch, key_count)
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        first = await get_status(session, url)
+        await asyncio.sleep(seconds)
+        baseline = await get_status(session, url)
+        deadline = time.monotonic() + seconds
+        start = time.monotonic()
+        await asyncio.gather(*[
+            sender(session, url, deadline, keys, batch, ttl, latencies)
+            for i in range(senders)
+        ])
+        elapsed = time.monotonic() - start
+        flooded = await get_status(session, url)
+
+    for (name, before, after) in (('Baseline', first, baseline), ('Flood', baseline, flooded)):
+        (frames, mean, stdev) = phase_lateness(before['lateness'], after['lateness'])
+        if frames:
+            print('{0}: {1} frames, lateness mean {2:.2f}ms, stdev {3:.2f}ms'.format(name, frames, mean * 1000, stdev * 1000))
+        else:
+            print('{0}: no frames'.format(name))
+    if flooded['lateness']['max'] is not None:
+        print('Worst lateness since the daemon started: {0:.2f}ms'.format(flooded['lateness']['max'] * 1000))
+    data = flooded['data'] or {}
+    print('Sent {0} batches ({1} updates) in {2:.1f}s: {3:.0f} updates/s'.format(
+        len(latencies), len(latencies) * batch, elapsed, len(latencies) * batch / elapsed,
+    ))
+    if latencies:
+        ordered = sorted(latencies)
+        print('POST latency: p50 {0:.2f}ms, p99 {1:.2f}ms, max {2:.2f}ms'.format(
+            percentile(ordered, 0.50) * 1000, percentile(ordered, 0.99) * 1000, ordered[-1] * 1000,
+        ))
+    print('Store: {0} live keys, {1} updates coalesced before being shown'.format(data.get('keys'), data.get('coalesced')))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080', help='Base URL of the daemon')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each phase')
+    parser.add_argument('--senders', type=int, default=8, help='Concurrent senders')
+    parser.add_argument('--batch', type=int, default=20, help='Values per POST')
+    parser.add_argument('--keys', type=int, default=50, help='Distinct keys to update')
+    parser.add_argument('--ttl', type=float, default=30, help='Time to live of the values, in seconds')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    asyncio.run(run(args.url.rstrip('/'), args.seconds, args.senders, args.batch, args.keys, args.ttl))
+
+
+if __name__ == '__main__':
+    main()
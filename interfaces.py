@@ -0,0 +1,127 @@
+'''
+Cached snapshot of the network interfaces and their IPv4 addresses.
+
+psutil.net_if_addrs() enumerates every interface on the system, which is
+measurable on hosts with many container veth pairs. Instead, the formatted
+lines are computed once and reused until the kernel reports a change through
+an rtnetlink socket. Where rtnetlink is not available, the snapshot is simply
+refreshed after a polling interval.
+'''
+
+import errno
+import re
+import socket
+from time import monotonic
+
+
+# Interfaces that are never shown: the loopback and the docker internal network.
+IGNORED_INTERFACES = re.compile(r'^(?:lo$|(?:docker|veth|br-).+)')
+
+# From linux/rtnetlink.h
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+
+def ip_format(ip, iface):
+    total = 16
+    # IPv4 digits
+    digits = sum(1 for c in ip if c != '.')
+    # Interface length
+    letters = len(iface)
+    pad = max(0, total - digits - letters)
+    padding = ' ' * pad
+    return ip + padding + iface
+
+
+def open_rtnetlink():
+    '''Returns a non-blocking socket subscribed to link and IPv4 address changes, or None if not available.'''
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        # AttributeError: not Linux.
+        return None
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+class InterfaceCache:
+    def __init__(self, poll_interval:float = 30, use_netlink:bool = True, clock=monotonic):
+        '''
+        Parameters:
+        poll_interval: How often to rescan when rtnetlink is not available
+        use_netlink: Whether to try rtnetlink notifications at all
+        clock: Monotonic clock for the polling fallback
+        '''
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._sock = open_rtnetlink() if use_netlink else None
+        self._lines = None
+        self._timestamp = None
+        # How many times the system was actually scanned.
+        self.scans = 0
+
+    def __repr__(self):
+        return 'InterfaceCache(netlink={0})'.format(self._sock is not None)
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _changed(self) -> bool:
+        if self._lines is None:
+            return True
+        if self._sock is None:
+            return self.clock() - self._timestamp >= self.poll_interval
+        changed = False
+        # Drain all pending notifications, their contents don't matter.
+        while True:
+            try:
+                if not self._sock.recv(65536):
+                    break
+                changed = True
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # Notifications were lost, assume something changed.
+                    changed = True
+                    continue
+                raise
+        return changed
+
+    def _scan(self):
+        # Imported here, as it is slow to import and not needed before the first scan.
+        import psutil
+        lines = []
+        for interface, addresses in sorted(psutil.net_if_addrs().items()):
+            if IGNORED_INTERFACES.match(interface):
+                continue
+            for addr in addresses:
+                # socket.AF_INET for IPv4
+                # socket.AF_INET6 for IPv6
+                # psutil.AF_LINK for hardware MAC address
+
+                # Only show IPv4 addresses, ignore everything else.
+                if addr.family == socket.AF_INET:
+                    lines.append(ip_format(addr.address, interface))
+        self.scans += 1
+        return tuple(lines)
+
+    def lines(self):
+        '''Returns the formatted lines (one per IPv4 address), rescanning only if something changed.'''
+        if self._changed():
+            self._lines = self._scan()
+            self._timestamp = self.clock()
+        return self._lines
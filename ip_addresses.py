@@ -1,80 +1,91 @@
 #!/usr/bin/env python3
 
-import psutil
-import re
+from time import perf_counter
+# For the startup timing report.
+STARTED_AT = perf_counter()
+
+# Heavy modules (psutil, dateutil) are imported only where they are used, so
+# the first frame shows up as soon as possible after boot.
+import argparse
+import logging
+import segment7
 import signal
-from datetime import date, datetime, time, timedelta
-from dateutil.easter import easter
-from dateutil.relativedelta import relativedelta
-from dateutil.tz import gettz
+import sys
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 from functools import partial
 from os import getloadavg
-from socket import AF_INET
-from time import sleep
-from tm1640 import TM1640
+from carousel import KeyedFrame, SlowViewPool, ViewCache, aligned, encode_frame, iterate_views, live, slow, valid_until, view_attribute, view_name, write_frame
+from clock_renderer import ClockRenderer
+from fade import Fader
+from interfaces import InterfaceCache
+from scheduler import FrameScheduler, IdleMeter
+from sensors import Sampler, SysfsFile
+from timeline import Timeline, easter_offset, fixed_date, koningsdag, last_sunday
+from tm1640 import ThreadedTM1640
+from transitions import Transition
+
+IMPORTED_AT = perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+# This Raspberry Pi 4 has cpu0 to cpu4.
+# I believe all of them follow the same clock, so I'm just reading one.
+CPU_TEMPERATURE_PATH = '/sys/class/thermal/thermal_zone0/temp'
+CPU_FREQ_PATH = '/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq'
+# There is psutil.cpu_freq() as well, but that function is longer and heavier.
+# https://github.com/giampaolo/psutil/blob/release-5.8.0/psutil/_pslinux.py#L722
+#
+# There is also: vcgencmd measure_clock arm
+# This should measure the actual CPU speed (even when being throttled);
+# while the scaling_cur_freq measures the requested CPU speed (i.e. the
+# frequency requested by the kernel).
+# https://magpi.raspberrypi.com/articles/how-to-overclock-raspberry-pi-4
+
+
+def build_sampler(temperature_path=CPU_TEMPERATURE_PATH, freq_path=CPU_FREQ_PATH):
+    '''Returns the Sampler shared by all views.'''
+    sampler = Sampler()
+    # Raw data is in milliCelsius, the value is in Celsius.
+    sampler.add('cpu_temperature', SysfsFile(temperature_path, lambda raw: float(raw) / 1000).read)
+    # Raw data is in kHz, the value is in MHz.
+    sampler.add('cpu_freq', SysfsFile(freq_path, lambda raw: int(raw) / 1000).read)
+    sampler.add('loadavg', getloadavg)
+    sampler.add('memory', virtual_memory, ttl=2)
+    return sampler
+
+
+def virtual_memory():
+    import psutil
+    return psutil.virtual_memory()
 
 
-def ip_format(ip, iface):
-    total = 16
-    # IPv4 digits
-    digits = sum(1 for c in ip if c != '.')
-    # Interface length
-    letters = len(iface)
-    pad = max(0, total - digits - letters)
-    padding = ' ' * pad
-    return ip + padding + iface
-
-
-def slurp(filename):
-    with open(filename) as f:
-        return f.read()
-
-
-# Returns Celsius.
-def read_cpu_temperature():
-    # Raw data is in milliCelsius.
-    return float(slurp('/sys/class/thermal/thermal_zone0/temp')) / 1000;
+def raiseKeyboardInterrupt(signum, frame):
+    raise KeyboardInterrupt()
 
 
-# Returns MHz.
-def read_cpu_freq():
-    # This Raspberry Pi 4 has cpu0 to cpu4.
-    # I believe all of them follow the same clock, so I'm just reading one.
-    # Raw data is in kHz.
-    return int(slurp('/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq')) / 1000;
-    # There is psutil.cpu_freq() as well, but that function is longer and heavier.
-    # https://github.com/giampaolo/psutil/blob/release-5.8.0/psutil/_pslinux.py#L722
-    #
-    # There is also: vcgencmd measure_clock arm
-    # This should measure the actual CPU speed (even when being throttled);
-    # while the scaling_cur_freq measures the requested CPU speed (i.e. the
-    # frequency requested by the kernel).
-    # https://magpi.raspberrypi.com/articles/how-to-overclock-raspberry-pi-4
+# Renderers for the clock views, keyed by (prefix, suffix, date_format).
+_clock_renderers = {}
 
 
-def raiseKeyboardInterrupt(signum, frame):
-    raise KeyboardInterrupt()
+def _clock_renderer(prefix='', suffix='', date_format=''):
+    key = (prefix, suffix, date_format)
+    renderer = _clock_renderers.get(key)
+    if renderer is None:
+        renderer = _clock_renderers[key] = ClockRenderer(prefix, suffix, date_format)
+    return renderer
 
 
+@aligned
 def display_clock():
-    # The length of this string must be a divisor of 60.
-    dashes = "_-‾-"
-    now = datetime.now()
-    # text = now.isoformat(' ', 'seconds')
-    # text = now.time().isoformat('seconds')
-    text = now.strftime('%H:%M:%S  %a %d')
-    text = text.replace(':', dashes[now.second % len(dashes)])
-    yield text
+    # Same as: now.strftime('%H:%M:%S  %a %d'), with animated dashes instead of ':'.
+    yield _clock_renderer(date_format='  %a %d').render(datetime.now())
 
 
+@aligned
 def display_clock_timezone(tz, prefix='', suffix=''):
-    # The length of this string must be a divisor of 60.
-    dashes = "_-‾-"
-    now = datetime.now(tz)
-    time = now.strftime('%H:%M:%S')
-    time = time.replace(':', dashes[now.second % len(dashes)])
-    text = prefix + time + suffix
-    yield text
+    yield _clock_renderer(prefix, suffix).render(datetime.now(tz))
 
 
 def display_relative_time(reference, prefix='', suffix='', now=None):
@@ -91,6 +102,7 @@ def display_relative_time(reference, prefix='', suffix='', now=None):
         return
 
     if now is None:
+        from dateutil.tz import gettz
         now = datetime.now(gettz())
 
     # timedelta cannot be used here, as it will not consider DST changes.
@@ -117,161 +129,266 @@ def display_relative_time(reference, prefix='', suffix='', now=None):
     yield prefix + out + suffix
 
 
+def relative_time_validity(reference):
+    '''Validity policy for display_relative_time(reference, ...): until the next change of its output.'''
+    ref = reference.timestamp()
+    def policy(now):
+        secs = int(abs(now - ref))
+        if secs >= 7 * 86400:
+            step = 86400  # Weeks and days.
+        elif secs >= 86400:
+            step = 60  # Days, hours and minutes.
+        else:
+            step = 1
+        if now >= ref:
+            return ref + ((now - ref) // step + 1) * step
+        # Counting down, the output changes when the remaining time drops below the current step.
+        return ref - secs // step * step
+    return policy
+
+
 def display_calendar_age(reference, prefix='', suffix='', now=None):
     # Do nothing if there is no reference time.
     if reference is None:
         return
 
+    from dateutil.relativedelta import relativedelta
     if now is None:
+        from dateutil.tz import gettz
         now = datetime.now(gettz())
 
-    delta = abs(relativedelta(reference, now))
+    # Counted on the calendar of the reference, so the output changes at its time of day (see calendar_age_validity).
+    if reference.tzinfo is not None:
+        now = now.astimezone(reference.tzinfo)
+    # In whole seconds: relativedelta rounds a negative fraction of a second up to a whole day.
+    delta = abs(relativedelta(reference.replace(microsecond=0), now.replace(microsecond=0)))
     out = '{}y {}m {}d'.format(delta.years, delta.months, delta.days)
     yield prefix + out + suffix
 
 
-def display_interfaces():
-    for interface, addresses in sorted(psutil.net_if_addrs().items()):
-        if interface == 'lo':
-            # Skip the loopback interface.
-            continue
-        if re.match(r'^(docker|veth|br-).+', interface):
-            # Skip the docker internal network.
-            continue
-        for addr in addresses:
-            # socket.AF_INET for IPv4
-            # socket.AF_INET6 for IPv6
-            # psutil.AF_LINK for hardware MAC address
+def calendar_age_validity(reference):
+    '''Validity policy for display_calendar_age(reference, ...): until the time of day of the reference, or midnight, whichever comes first, in the timezone of the reference.
+
+    The years, months and days between the reference and now only depend on the date of now and on whether it is past the time of day of the reference, as both are on the same calendar. The date matters because months have different lengths: e.g. six months before both March 30th and March 31st is September 30th.
+    '''
+    time_of_day = dict(hour=reference.hour, minute=reference.minute, second=reference.second, microsecond=0)
+    def policy(now):
+        today = datetime.fromtimestamp(now, reference.tzinfo)
+        change = today.replace(**time_of_day).timestamp()
+        if change > now:
+            return change
+        tomorrow = today.date() + timedelta(days=1)
+        return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=reference.tzinfo).timestamp()
+    return policy
+
+
+def display_next_event(timeline, tz):
+    '''Displays the relative time until the next event of a timeline.Timeline.'''
+    now = datetime.now(tz)
+    event = timeline.next_after(now)
+    if event is not None:
+        yield from display_relative_time(event.when, event.label, now=now)
+
 
-            # Only show IPv4 addresses, ignore everything else.
-            if addr.family == AF_INET:
-                text = ip_format(addr.address, interface)
-                yield text
+@slow(timeout=0.2)
+def display_interfaces(interfaces):
+    yield from interfaces.lines()
 
 
-def display_cpu_stats():
+@slow(timeout=0.1)
+def display_cpu_stats(sampler):
     text = ' {:2.0f}°C   {:4.0f}MHz'.format(
-        read_cpu_temperature(),
-        read_cpu_freq(),
+        sampler.get('cpu_temperature'),
+        sampler.get('cpu_freq'),
     )
     yield text
+    # Min, average and max over the recent samples.
+    summary = sampler.summary('cpu_temperature')
+    if summary is not None:
+        text = 'temp {:2.0f} {:2.0f} {:2.0f}°C'.format(*summary)
+        yield text
     # TODO: Display only 3 digits for loadavg. I mean:
     # 0.00  to  9.99  or  10.0  to  99.9
     # Not sure if I need a custom formatting function. Have to investigate.
-    text = 'load {:.2f} {:.2f} {:.2f}'.format(*getloadavg())
+    text = 'load {:.2f} {:.2f} {:.2f}'.format(*sampler.get('loadavg'))
     yield text
 
 
-def display_mem_stats():
+@slow(timeout=0.1)
+def display_mem_stats(sampler):
     # Only showing RAM stats because this system doesn't have any SWAP configured.
-    ram = psutil.virtual_memory()
+    ram = sampler.get('memory')
     # ram.percent is the used percentage; but it's hard to show '%' on 7-segment display.
     # Well, '%' can be shown as '°o', but it's confusing anyway.
     text = 'RAM {:.0f}G  {:3.1f}G free'.format(ram.total / 1024**3 , ram.available / 1024**3 )
     yield text
 
 
-def main():
-    signal.signal(signal.SIGTERM, raiseKeyboardInterrupt)
+def data_format(key, value):
+    '''Formats a pushed value for the display: the key on the left, the value on the right.'''
+    if isinstance(value, float):
+        value = '{:.1f}'.format(value)
+    value = str(value)
+    # The dots don't take a digit of their own, so the lengths are counted in digits.
+    room = 16 - len(segment7.encode(value))
+    if room < 2:
+        # No room for the key and a space.
+        return value
+    while len(segment7.encode(key)) > room - 1:
+        key = key[:-1]
+    return key + ' ' * (room - len(segment7.encode(key))) + value
 
-    TZ_AMS = gettz('Europe/Amsterdam')
-    TZ_BRA = gettz('America/Sao_Paulo')
-    day = timedelta(days=1)
-    # Quick way to convert a plain date to a datetime (at midnight).
-    d_to_dt = lambda d: datetime.combine(d, time.min, tzinfo=TZ_AMS)
 
-    birth = datetime(2020, 9, 3, 14, 40, tzinfo=TZ_AMS)
+@live
+def display_data(store):
+    '''Displays the values pushed to a datastore.DataStore, one per frame; nothing at all if there are none.'''
+    for (key, value) in store.items():
+        yield KeyedFrame(data_format(key, value), key)
 
-    future_events_carousel = sorted([
-        (datetime(2022,  8,  2, 14, 25, tzinfo=TZ_AMS), 'Welkom    '), # Arrival
-        (datetime(2022,  9, 22, 12, 45, tzinfo=TZ_AMS), 'Tot ziens '), # Departure
 
-        (datetime(2022,  3, 27,  2, 00, tzinfo=TZ_AMS), 'CET-CEST  '), # DST, Daylight Saving Time
-        (datetime(2022, 10, 30,  3, 00, tzinfo=TZ_AMS), 'CEST-CET  '), # DST, Daylight Saving Time
-        (datetime(2023,  3, 26,  2, 00, tzinfo=TZ_AMS), 'CET-CEST  '), # DST, Daylight Saving Time
-        (datetime(2023, 10, 29,  3, 00, tzinfo=TZ_AMS), 'CEST-CET  '), # DST, Daylight Saving Time
-        (datetime(2024,  3, 31,  2, 00, tzinfo=TZ_AMS), 'CET-CEST  '), # DST, Daylight Saving Time
-        (datetime(2024, 10, 27,  3, 00, tzinfo=TZ_AMS), 'CEST-CET  '), # DST, Daylight Saving Time
-    ])
-    future_holidays_carousel = sorted([
-        # I'm assuming this script will be restarted at least once per year.
-        (d_to_dt(easter(date.today().year    ) +  1 * day), 'Easter    '), # Easter Monday, Tweede Paasdag
-        (d_to_dt(easter(date.today().year + 1) +  1 * day), 'Easter    '), # Easter Monday, Tweede Paasdag
+def build_views(sampler, interfaces, store=None):
+    '''Returns the list of (callback, delay) shown in the carousel.
 
-        (d_to_dt(easter(date.today().year    ) + 39 * day), 'Ascension '), # Ascension, Hemelvaartsdag
-        (d_to_dt(easter(date.today().year + 1) + 39 * day), 'Ascension '), # Ascension, Hemelvaartsdag
-
-        (d_to_dt(easter(date.today().year    ) + 50 * day), 'Whit Mon  '), # Whit Monday, Tweede Pinksterdag
-        (d_to_dt(easter(date.today().year + 1) + 50 * day), 'Whit Mon  '), # Whit Monday, Tweede Pinksterdag
+    If store (a datastore.DataStore) is given, the values pushed to it are shown as well.
+    '''
+    from dateutil.tz import gettz
+    TZ_AMS = gettz('Europe/Amsterdam')
+    TZ_BRA = gettz('America/Sao_Paulo')
 
-        (d_to_dt(date(date.today().year    ,  4, 27)), 'Koning    '), # Koningsdag
-        (d_to_dt(date(date.today().year + 1,  4, 27)), 'Koning    '), # Koningsdag
+    birth = datetime(2020, 9, 3, 14, 40, tzinfo=TZ_AMS)
 
-        (d_to_dt(date(date.today().year    , 12, 26)), 'Kerstdag  '), # Xmas, Tweede Kerstdag
-        (d_to_dt(date(date.today().year + 1, 12, 26)), 'Kerstdag  '), # Xmas, Tweede Kerstdag
+    future_events = Timeline(
+        events=[
+            (datetime(2022,  8,  2, 14, 25, tzinfo=TZ_AMS), 'Welkom    '), # Arrival
+            (datetime(2022,  9, 22, 12, 45, tzinfo=TZ_AMS), 'Tot ziens '), # Departure
+        ],
+        rules=[
+            (last_sunday( 3, 2, TZ_AMS), 'CET-CEST  '), # DST, Daylight Saving Time
+            (last_sunday(10, 3, TZ_AMS), 'CEST-CET  '), # DST, Daylight Saving Time
+        ],
+    )
+    future_holidays = Timeline(rules=[
+        (easter_offset( 1, TZ_AMS), 'Easter    '), # Easter Monday, Tweede Paasdag
+        (easter_offset(39, TZ_AMS), 'Ascension '), # Ascension, Hemelvaartsdag
+        (easter_offset(50, TZ_AMS), 'Whit Mon  '), # Whit Monday, Tweede Pinksterdag
+        (koningsdag(TZ_AMS),         'Koning    '), # Koningsdag
+        (fixed_date(12, 26, TZ_AMS), 'Kerstdag  '), # Xmas, Tweede Kerstdag
     ])
     # TODO: maybe display other birthdays
 
     views = [
         *[(display_clock, 1)] * 4,
-        (partial(display_calendar_age, birth, 'baby '), 3),
-        (partial(display_relative_time, birth, 'baby '), 3),
-
-        (lambda: display_relative_time(
-            # Picking up the first element...
-            *next(
-                # From a generator...
-                (item for item in
-                    # That tests these items...
-                    future_events_carousel
-                    # Against a predicate.
-                    if item[0] > datetime.now(TZ_AMS)
-                )
-            )
-        ), 3),
-        (lambda: display_relative_time(
-            # Picking up the first element...
-            *next(
-                # From a generator...
-                (item for item in
-                    # That tests these items...
-                    future_holidays_carousel
-                    # Against a predicate.
-                    if item[0] > datetime.now(TZ_AMS)
-                )
-            )
-        ), 3),
+        (valid_until(calendar_age_validity(birth))(partial(display_calendar_age, birth, 'baby ')), 3),
+        (valid_until(relative_time_validity(birth))(partial(display_relative_time, birth, 'baby ')), 3),
+
+        (partial(display_next_event, future_events, TZ_AMS), 3),
+        (partial(display_next_event, future_holidays, TZ_AMS), 3),
 
         *[(partial(display_clock_timezone, TZ_BRA, prefix='Brazil '), 1)] * 4,
         *[(display_clock, 1)] * 4,
-        (display_interfaces, 4),
+        (partial(display_interfaces, interfaces), 4),
         *[(display_clock, 1)] * 4,
-        (display_cpu_stats, 3),
-        (display_mem_stats, 3),
+        (partial(display_cpu_stats, sampler), 3),
+        (partial(display_mem_stats, sampler), 3),
     ]
+    if store is not None:
+        views.append((partial(display_data, store), 3))
+    return views
 
-    with TM1640(clk_pin=24, din_pin=23) as display:
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Shows the views on a TM1640 LED display.')
+    parser.add_argument('--headless', action='store_true', help='Use mock GPIO pins and draw the display in the terminal, e.g. without a Raspberry Pi')
+    parser.add_argument('--record', metavar='PATH', help='Record every frame into this ring file, see replay.py')
+    parser.add_argument('--idle-report', action='store_true', help='Print the wakeups and CPU time of the process every minute')
+    return parser.parse_args()
+
+
+def view_failed(callback, exception):
+    logger.error('The view %s failed, skipping it', view_name(callback), exc_info=exception)
+
+
+def main():
+    args = parse_args()
+    signal.signal(signal.SIGTERM, raiseKeyboardInterrupt)
+
+    options = {}
+    outputs = []
+    if args.headless:
+        from gpiozero.pins.mock import MockFactory
+        from outputs import TerminalRenderer
+        options['pin_factory'] = MockFactory()
+        outputs.append(TerminalRenderer())
+    recorder = nullcontext()
+    if args.record:
+        from outputs import FrameRecorder
+        recorder = FrameRecorder(args.record)
+        outputs.append(recorder)
+
+    # The GPIO communication happens in a background thread, so a slow frame
+    # doesn't delay the timing of the views.
+    with recorder, ThreadedTM1640(clk_pin=24, din_pin=23, outputs=outputs, **options) as display:
         try:
+            # Something on the display right after the pins are set up,
+            # everything else is prepared while this is shown.
             display.brightness = 1
             display.write_text('{:^16}'.format('-- HELLO --'))
-            sleep(1)
-            while True:
-                for (callback, delay) in views:
-                    for text in callback():
-                        # print(repr(text))
-                        if isinstance(text, bytes):
-                            display.write_bytes(text)
-                        elif isinstance(text, str):
-                            display.write_text(text)
-                        else:
-                            raise TypeError('Expected str or bytes, received {!r}'.format(text))
-                        sleep(delay)
+            hello_at = perf_counter()
+            # The fastest bus speed that is still safe for the chip, on this Pi and this Python.
+            timing = display.calibrate()
+
+            # Views marked as slow are computed in worker threads, so they can't stall the clocks.
+            with build_sampler() as sampler, InterfaceCache() as interfaces, SlowViewPool() as pool:
+                # Views that declare how long their output stays valid are only rendered again when it expires.
+                cache = ViewCache()
+                # Sampling in the background, for the min/max/average readouts.
+                sampler.start(interval=5)
+                views = build_views(sampler, interfaces)
+
+                scheduler = FrameScheduler()
+                idle = IdleMeter() if args.idle_report else None
+                # Fade steps are sent while waiting for the next frame, or together with it.
+                fader = Fader(display)
+                first_frame = True
+                previous = (None, None)
+                # A failing view (e.g. no sysfs sensors with --headless) is skipped, the others go on.
+                for (callback, text, delay) in iterate_views(views, pool=pool, cache=cache, on_error=view_failed):
+                    (previous_callback, previous_frame) = previous
+                    frame = encode_frame(text)
+                    aligned = view_attribute(callback, 'aligned', False)
+                    if callback is not previous_callback and previous_frame is not None and not aligned:
+                        # A new view slides in. A clock is due on the second, so it just cuts in instead of showing up late.
+                        Transition(previous_frame, frame, 'slide').play(display, sleep=fader.sleep)
+                    write_frame(display, text)
+                    previous = (callback, frame)
+                    if first_frame:
+                        first_frame = False
+                        print('Startup: imports {:.3f}s, HELLO frame {:.3f}s, first view {:.3f}s'.format(
+                            IMPORTED_AT - STARTED_AT,
+                            hello_at - STARTED_AT,
+                            perf_counter() - STARTED_AT,
+                        ), file=sys.stderr)
+                        print('Bus timing: {:.0f}ns per pin change (minimum {}ns, waiting {}ns), {:.0f} bits/s'.format(
+                            timing.edge_ns,
+                            timing.min_interval_ns,
+                            timing.wait_ns,
+                            timing.bit_rate,
+                        ), file=sys.stderr)
+                    scheduler.wait(delay, aligned, sleep=fader.sleep)
+                    if idle is not None and idle.clock() - idle.start >= 60:
+                        report = idle.report()
+                        print('Idle cost: {:.0f} wakeups/min, {:.3f}s CPU/min'.format(
+                            report['wakeups_per_minute'],
+                            report['cpu_seconds_per_minute'],
+                        ), file=sys.stderr)
+                        idle.reset()
         except KeyboardInterrupt:
             display.write_text('GOODBYE...')
-            display.brightness = 1
-            sleep(1)
+            fader = Fader(display)
+            fader.fade_to(0, duration=1)
+            fader.sleep(1)
+            # The last step of the fade goes together with this frame.
             display.write_text('')
-            display.brightness = 0
 
 
 if __name__ == '__main__':
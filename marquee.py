@@ -0,0 +1,69 @@
+'''
+Marquee: scrolls a text longer than the display.
+
+The text is encoded through segment7 only once, and every window of the
+display width is precomputed as bytes. Playing it back is just a matter of
+writing those bytes at the right time. The position is derived from a
+monotonic clock, so the scrolling speed doesn't depend on the text length,
+and if a frame is late the next ones are skipped instead of slowing down.
+'''
+
+import segment7
+from time import monotonic, sleep
+
+
+class Marquee:
+    def __init__(self, text:str, width:int = 16, gap:int = 4):
+        '''
+        Parameters:
+        text: The text to scroll, dots are folded into the previous digit as usual
+        width: How many digits the display has
+        gap: How many blank digits between the end of the text and its beginning, when looping
+        '''
+        self.text = text
+        self.width = width
+        encoded = segment7.encode(text)
+        if len(encoded) <= width:
+            # Fits on the display, nothing to scroll.
+            self.frames = (encoded.ljust(width, b'\0'),)
+        else:
+            source = encoded + bytes(gap)
+            # The last frames wrap around to the beginning of the text.
+            wrapped = source + source[:width - 1]
+            self.frames = tuple(wrapped[i:i + width] for i in range(len(source)))
+
+    def __repr__(self):
+        return 'Marquee({0.text!r}, width={0.width})'.format(self)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def timeline(self, fps:float = 4, loops:int = 1, clock=monotonic):
+        '''Yields (frame, deadline) tuples: write the frame, then wait until the deadline (in clock() time).
+
+        After the given number of loops, it ends with the first frame (without a deadline). If the consumer is late, frames are skipped to keep the speed constant.
+        '''
+        count = len(self.frames)
+        total = count * loops
+        start = clock()
+        n = 0
+        while n < total:
+            yield (self.frames[n % count], start + (n + 1) / fps)
+            n = max(n + 1, int((clock() - start) * fps))
+        yield (self.frames[0], None)
+
+    def play(self, display, fps:float = 4, loops:int = 1, clock=monotonic, sleep=sleep):
+        '''Plays the marquee on the display, blocking until it is done.'''
+        for (frame, deadline) in self.timeline(fps, loops, clock):
+            display.write_bytes(frame)
+            if deadline is not None:
+                sleep(max(0, deadline - clock()))
+
+    async def play_async(self, display, fps:float = 4, loops:int = 1):
+        '''Same as play(), but for an asyncio loop.'''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        for (frame, deadline) in self.timeline(fps, loops, loop.time):
+            display.write_bytes(frame)
+            if deadline is not None:
+                await asyncio.sleep(max(0, deadline - loop.time()))
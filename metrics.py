@@ -0,0 +1,163 @@
+'''
+Minimal runtime metrics (counters and histograms), rendered in the Prometheus text format.
+
+See: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Only what this project needs is implemented. The hot paths hold a reference
+to the (labeled) child objects, so recording a value is just an attribute
+update. When no metrics object is passed around, the instrumented code skips
+everything behind a single `is not None` test.
+'''
+
+from bisect import bisect_left
+
+
+# Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# For frame rates (frames per second).
+FPS_BUCKETS = (5, 10, 20, 30, 40, 45, 50, 60, 100)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (name, value) in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, names, values):
+        yield '{}{} {}'.format(name, _format_labels(names, values), _format_value(self.value))
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One extra count for the +Inf bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, names, values):
+        cumulative = 0
+        for (bound, count) in zip((*self.buckets, float('inf')), self.counts):
+            cumulative += count
+            le = 'le="{}"'.format(_format_value(bound))
+            yield '{}_bucket{} {}'.format(name, _format_labels(names, values, le), cumulative)
+        yield '{}_sum{} {}'.format(name, _format_labels(names, values), _format_value(self.sum))
+        yield '{}_count{} {}'.format(name, _format_labels(names, values), self.count)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name:str, help:str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        '''Returns the child for these label values, creating it if needed.'''
+        if len(values) != len(self.labelnames):
+            raise ValueError('Expected {} label values, received {}'.format(len(self.labelnames), len(values)))
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self):
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} {}'.format(self.name, self.type)
+        for (values, child) in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name:str, help:str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError('Metric {!r} is already registered'.format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, help:str, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name:str, help:str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        '''Returns all metrics in the Prometheus text format.'''
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class DisplayMetrics:
+    '''Metrics recorded by TM1640 on every transmission.'''
+    def __init__(self, registry:Registry):
+        self.frames = registry.counter('display_frames_total', 'Frames written to the display').labels()
+        self.bytes = registry.counter('display_bytes_total', 'Bytes sent over the wire, including commands').labels()
+        self.edges = registry.counter('display_pin_edges_total', 'Pin state changes on CLK and DIN').labels()
+        self.transmit_seconds = registry.histogram('display_transmit_seconds', 'Time to write a frame to the display').labels()
+
+
+class CarouselMetrics:
+    '''Metrics recorded by the carousel for each view.'''
+    def __init__(self, registry:Registry):
+        self.render_seconds = registry.histogram('view_render_seconds', 'Time to render a frame of a view', ['view'])
+        self.lateness_seconds = registry.histogram('frame_lateness_seconds', 'How long after its deadline a frame started').labels()
+        self.view_cache_hits = registry.counter('view_cache_hits_total', 'Views whose frames were reused from the cache', ['view'])
+        self.view_cache_misses = registry.counter('view_cache_misses_total', 'Views rendered because their cached frames were missing or expired', ['view'])
+        self.view_errors = registry.counter('view_errors_total', 'Views that raised an exception, and were skipped', ['view'])
+        self.view_timeouts = registry.counter('view_timeouts_total', 'Slow views not ready in time, whose last good frames were shown instead', ['view'])
+        self.transition_fps = registry.histogram('transition_fps', 'Frame rate achieved by the transitions between views', ['effect'], buckets=FPS_BUCKETS)
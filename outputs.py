@@ -0,0 +1,156 @@
+'''
+Additional outputs for TM1640, to debug and profile without a Raspberry Pi.
+
+An output is any object with a `show(frame, brightness)` method. TM1640 calls
+it after every transmission that changed something, with the bytes now on
+the display and the brightness (0 to 8). Outputs are not closed by TM1640,
+they belong to whoever created them.
+
+* FrameRecorder appends every frame to a fixed-size ring file through mmap,
+  so recording costs no system call per frame. See replay.py to analyse it.
+* TerminalRenderer draws the seven-segment digits in a terminal.
+
+Together with gpiozero's MockFactory, they allow running the views headless.
+'''
+
+import mmap
+import struct
+import sys
+from collections import namedtuple
+from time import monotonic, time
+
+
+# magic, version, width (bytes per frame), capacity (frames), count (frames ever written)
+HEADER = struct.Struct('<4sHHIQ')
+MAGIC = b'TM16'
+VERSION = 1
+
+Record = namedtuple('Record', 'time monotonic brightness frame')
+
+
+def _record_struct(width:int):
+    # wall clock time, monotonic time, brightness, frame
+    return struct.Struct('<ddB{0}s'.format(width))
+
+
+class FrameRecorder:
+    def __init__(self, path:str, capacity:int = 65536, width:int = 16, clock=monotonic, wall_clock=time):
+        '''
+        Parameters:
+        path: The ring file, created or overwritten
+        capacity: How many frames are kept; older frames are overwritten
+        width: How many bytes per frame (16 × N for MultiTM1640)
+        clock: Monotonic clock, for the intervals between frames
+        wall_clock: Clock for the absolute timestamps
+        '''
+        self.path = path
+        self.capacity = capacity
+        self.width = width
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._record = _record_struct(width)
+        self.count = 0
+        size = HEADER.size + capacity * self._record.size
+        with open(path, 'w+b') as f:
+            f.truncate(size)
+            # The mapping stays valid after the file is closed.
+            self._mmap = mmap.mmap(f.fileno(), size)
+        self._write_header()
+
+    def __repr__(self):
+        return 'FrameRecorder({0.path!r}, capacity={0.capacity}, width={0.width})'.format(self)
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self.width, self.capacity, self.count)
+
+    def show(self, frame:bytes, brightness:int):
+        offset = HEADER.size + (self.count % self.capacity) * self._record.size
+        self._record.pack_into(self._mmap, offset, self.wall_clock(), self.clock(), brightness, frame)
+        self.count += 1
+        # The count is updated after the record, so a reader never sees a half-written frame as valid.
+        self._write_header()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+
+def read_recording(path:str):
+    '''Returns (count, records) from a ring file: the total number of frames ever written, and the Records still in the file, oldest first.'''
+    with open(path, 'rb') as f:
+        data = f.read()
+    (magic, version, width, capacity, count) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a frame recording: {!r}'.format(path))
+    record = _record_struct(width)
+    kept = min(count, capacity)
+    # The oldest record is right after the newest one, once the ring is full.
+    first = count - kept
+    records = [
+        Record(*record.unpack_from(data, HEADER.size + (i % capacity) * record.size))
+        for i in range(first, count)
+    ]
+    return (count, records)
+
+
+# Segments of each digit, as (row, column, character): a, b, c, d, e, f, g, and the dot.
+_SEGMENTS = (
+    (0, 1, '_'),
+    (1, 2, '|'),
+    (2, 2, '|'),
+    (2, 1, '_'),
+    (2, 0, '|'),
+    (1, 0, '|'),
+    (1, 1, '_'),
+    (2, 3, '.'),
+)
+
+# 256-color palette codes for the brightness levels 1 to 8, from dark red to bright red.
+_COLORS = (52, 88, 124, 160, 196, 203, 210, 217)
+
+
+def render_digits(frame:bytes):
+    '''Returns the three lines of text drawing the digits of a frame.
+
+    >>> print('\\n'.join(render_digits(bytes([0b0111111, 0b1000_0110]))))
+     _
+    | |   |
+    |_|   |.
+    '''
+    rows = [[' '] * (4 * len(frame)) for _ in range(3)]
+    for (i, byte) in enumerate(frame):
+        for (bit, (row, column, char)) in enumerate(_SEGMENTS):
+            if byte & (1 << bit):
+                rows[row][4 * i + column] = char
+    return [''.join(row).rstrip() for row in rows]
+
+
+class TerminalRenderer:
+    def __init__(self, stream=None):
+        '''
+        Parameters:
+        stream: Where to draw, sys.stdout by default; it should be an ANSI terminal
+        '''
+        self.stream = stream if stream is not None else sys.stdout
+        self._drawn = False
+
+    def __repr__(self):
+        return 'TerminalRenderer({0.stream!r})'.format(self)
+
+    def show(self, frame:bytes, brightness:int):
+        lines = render_digits(frame) if brightness else [''] * 3
+        color = '\x1b[38;5;{0}m'.format(_COLORS[brightness - 1]) if brightness else ''
+        # Back to the beginning of the previous drawing, then overwrite it line by line.
+        text = '\x1b[3F' if self._drawn else ''
+        text += ''.join('{0}{1}\x1b[0m\x1b[K\n'.format(color, line) for line in lines)
+        self.stream.write(text)
+        self.stream.flush()
+        self._drawn = True
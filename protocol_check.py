@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''
+Hardware-free checks of what tm1640.py actually puts on the pins.
+
+Runs against gpiozero's MockFactory, with mock pins that log every change of
+their state, in order, across all the pins. The pin changes of TM1640 (which
+replays precomputed edge tables and writes to the pins through a shortcut)
+are compared against a plain bit-by-bit reference writer using the public
+gpiozero API, the same algorithm as the original implementation. The pin
+changes of MultiTM1640 are decoded by one simulated chip per DIN pin, which
+must end up with its own slice of the frame.
+
+    ./protocol_check.py
+'''
+
+import logging
+import random
+import segment7
+import sys
+from gpiozero import OutputDevice
+from gpiozero.pins.mock import MockFactory, MockPin
+
+from metrics import DisplayMetrics, Registry
+from tm1640 import MultiTM1640, ThreadedTM1640, TM1640
+
+
+class RecordingPin(MockPin):
+    '''Mock pin that appends (pin name, state) to its factory's log on every change.
+
+    While its factory's `failures` is positive, a change raises OSError instead (and decrements it).
+    '''
+    def _change_state(self, value):
+        if self._factory.failures > 0:
+            self._factory.failures -= 1
+            raise OSError('Simulated GPIO failure')
+        changed = super()._change_state(value)
+        if changed:
+            self._factory.log.append((self._info.name, value))
+        return changed
+
+
+def recording_factory():
+    factory = MockFactory(pin_class=RecordingPin)
+    factory.log = []
+    factory.failures = 0
+    return factory
+
+
+class ReferenceWriter:
+    '''Sends TM1640 commands bit by bit through OutputDevice, like the original implementation.'''
+    def __init__(self, clk_pin:int, din_pin:int, pin_factory):
+        self.clk = OutputDevice(clk_pin, initial_value=True, pin_factory=pin_factory)
+        self.din = OutputDevice(din_pin, initial_value=True, pin_factory=pin_factory)
+
+    def close(self):
+        self.clk.close()
+        self.din.close()
+
+    def send(self, data):
+        self.clk.on()
+        self.din.on()
+        self.din.off()
+        for byte in data:
+            for i in range(8):
+                self.clk.off()
+                self.din.value = (byte >> i) & 1
+                self.clk.on()
+            self.clk.off()
+        self.clk.off()
+        self.din.off()
+        self.clk.on()
+        self.din.on()
+
+
+class ChipSimulator:
+    '''Decodes the pin changes seen by one TM1640 chip, and applies the commands to its display RAM.'''
+    def __init__(self, clk_name:str, din_name:str):
+        self.clk_name = clk_name
+        self.din_name = din_name
+        self.clk = False
+        self.din = False
+        self.ram = [None] * 16
+        self.fixed_address = False
+        self.display_control = None
+        # Bits of the current command, None outside of a command.
+        self._bits = None
+
+    def feed(self, log):
+        for (name, value) in log:
+            if name == self.clk_name:
+                if value and not self.clk and self._bits is not None:
+                    # Data is read on the rising edge of CLK.
+                    self._bits.append(self.din)
+                self.clk = value
+            elif name == self.din_name:
+                if self.clk and self.din and not value:
+                    # Start condition: DIN goes low while CLK is high.
+                    self._bits = []
+                elif self.clk and not self.din and value and self._bits is not None:
+                    # End condition: DIN goes high while CLK is high.
+                    self._command(self._bits)
+                    self._bits = None
+                self.din = value
+
+    def _command(self, bits):
+        # The last rising edge of CLK belongs to the end condition.
+        if len(bits) % 8 != 1:
+            raise AssertionError('{0}: command of {1} bits'.format(self.din_name, len(bits) - 1))
+        bits = bits[:-1]
+        data = [
+            sum(bit << i for (i, bit) in enumerate(bits[start:start + 8]))
+            for start in range(0, len(bits), 8)
+        ]
+        if not data:
+            return
+        kind = data[0] & 0b_1100_0000
+        if kind == 0b_0100_0000:
+            self.fixed_address = bool(data[0] & 0b_0000_0100)
+        elif kind == 0b_1100_0000:
+            address = data[0] & 0b_0000_1111
+            if self.fixed_address and len(data) > 2:
+                raise AssertionError('{0}: {1} bytes sent to a fixed address'.format(self.din_name, len(data) - 1))
+            for (i, byte) in enumerate(data[1:], address):
+                self.ram[i] = byte
+        elif kind == 0b_1000_0000:
+            self.display_control = data[0]
+        else:
+            raise AssertionError('{0}: unknown command {1:08b}'.format(self.din_name, data[0]))
+
+
+def sample_commands(count:int = 200, seed:int = 1640):
+    '''Commands covering every byte value after both DIN levels, plus random frames.'''
+    rng = random.Random(seed)
+    commands = [(0b_0100_0000,), (0b_0100_0100,), (0b_1000_1111,)]
+    # Each byte after a byte ending with DIN low (0x00) and high (0xFF).
+    commands += [(0b_1100_0000, byte) for byte in range(256)]
+    commands += [(0b_1100_0000, 0xFF, byte) for byte in range(256)]
+    commands += [
+        (0b_1100_0000 | rng.randrange(16), *(rng.randrange(256) for i in range(rng.randint(1, 16))))
+        for i in range(count)
+    ]
+    return commands
+
+
+def pin_changes(send, factory, data):
+    factory.log.clear()
+    send(data)
+    return list(factory.log)
+
+
+def check_edge_tables():
+    '''TM1640 must produce exactly the same pin changes as the reference writer, for every command.'''
+    factory = recording_factory()
+    reference_factory = recording_factory()
+    with TM1640(clk_pin=24, din_pin=23, pin_factory=factory) as display:
+        reference = ReferenceWriter(24, 23, reference_factory)
+        try:
+            for data in sample_commands():
+                expected = pin_changes(reference.send, reference_factory, data)
+                actual = pin_changes(display._send, factory, data)
+                if actual != expected:
+                    raise AssertionError('Different pin changes for command {0}: {1} instead of {2}'.format(bytes(data).hex(), actual, expected))
+        finally:
+            reference.close()
+
+
+def check_byte_range():
+    '''Values that are not bytes must be rejected clearly, not crash inside the edge tables.'''
+    with TM1640(clk_pin=24, din_pin=23, pin_factory=MockFactory()) as display:
+        for payload in ([256], [-1]):
+            try:
+                display.write_bytes(payload)
+            except ValueError:
+                continue
+            raise AssertionError('write_bytes({0!r}) was accepted'.format(payload))
+
+
+def check_cascade(count:int = 4, frames:int = 200, seed:int = 1640):
+    '''MultiTM1640 must put each display's slice of the frame, and the brightness, into the right chip.'''
+    rng = random.Random(seed)
+    factory = recording_factory()
+    metrics = DisplayMetrics(Registry())
+    din_pins = [23, 22, 27, 17][:count]
+    chips = [ChipSimulator('GPIO24', 'GPIO{0}'.format(pin)) for pin in din_pins]
+    frame = bytearray(16 * count)
+    with MultiTM1640(clk_pin=24, din_pins=din_pins, pin_factory=factory, metrics=metrics) as display:
+        for chip in chips:
+            chip.feed(factory.log)
+        # Only the changes made by the commands are counted in the metrics, not the initial pin states.
+        edges = metrics.edges.value
+        factory.log.clear()
+        sent = 0
+        for i in range(frames):
+            # A few changed digits (sent to fixed addresses) or a whole new frame (sent as a range).
+            if rng.random() < 0.5:
+                for j in range(rng.randint(1, 3)):
+                    frame[rng.randrange(len(frame))] = rng.randrange(256)
+            else:
+                frame = bytearray(rng.randrange(256) for j in range(len(frame)))
+            display.defer_brightness(rng.randint(1, 8))
+            if display.write_bytes(frame):
+                sent += 1
+            for chip in chips:
+                chip.feed(factory.log)
+            edges += len(factory.log)
+            factory.log.clear()
+            for (d, chip) in enumerate(chips):
+                if chip.ram != list(frame[16 * d:16 * d + 16]):
+                    raise AssertionError('Display {0} shows {1} instead of {2}'.format(d, bytes(b or 0 for b in chip.ram).hex(), frame[16 * d:16 * d + 16].hex()))
+                expected_control = 0b_1000_1000 | (display.brightness - 1)
+                if chip.display_control != expected_control:
+                    raise AssertionError('Display {0} received display control {1:08b} instead of {2:08b}'.format(d, chip.display_control, expected_control))
+    if metrics.edges.value != edges:
+        raise AssertionError('{0} pin changes counted in the metrics, instead of {1}'.format(metrics.edges.value, edges))
+    if metrics.frames.value != sent:
+        raise AssertionError('{0} frames counted in the metrics, instead of {1}'.format(metrics.frames.value, sent))
+
+
+def check_failed_write_resent():
+    '''After a failed write, ThreadedTM1640 must send the same frame and brightness again, instead of dropping them as unchanged.'''
+    factory = recording_factory()
+    chip = ChipSimulator('GPIO24', 'GPIO23')
+    display = ThreadedTM1640(clk_pin=24, din_pin=23, pin_factory=factory)
+    logger = logging.getLogger('tm1640')
+    logger.disabled = True  # The failure is expected, don't print its traceback.
+    try:
+        display.brightness = 3
+        display.write_text('HELLO')
+        display.flush()
+        factory.failures = 1
+        display.write_text('WORLD')
+        display.flush()
+        if display.failures != 1:
+            raise AssertionError('{0} failed writes reported instead of 1'.format(display.failures))
+        display.brightness = 3
+        display.write_text('WORLD')
+        display.flush()
+        chip.feed(factory.log)
+        expected = list(segment7.encode('WORLD').ljust(16, b'\0'))
+        if chip.ram != expected:
+            raise AssertionError('The display shows {0} instead of {1}'.format(bytes(b or 0 for b in chip.ram).hex(), bytes(expected).hex()))
+        if chip.display_control != 0b_1000_1010:
+            raise AssertionError('The brightness was not sent again: display control {0!r}'.format(chip.display_control))
+    finally:
+        logger.disabled = False
+        try:
+            display.close()
+        except RuntimeError:
+            # close() reports the failed write.
+            pass
+
+
+CHECKS = [
+    check_edge_tables,
+    check_byte_range,
+    check_cascade,
+    check_failed_write_resent,
+]
+
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+        except AssertionError as e:
+            failed += 1
+            print('FAIL {0}: {1}'.format(check.__name__, e))
+        else:
+            print('ok   {0}'.format(check.__name__))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+'''
+Analyses a ring file written by outputs.FrameRecorder.
+
+Reports the frame rate and the gaps between consecutive frames, which shows
+how steady the display output actually was. Optionally, the frames are played
+back in the terminal at their original pace.
+
+    ./replay.py frames.ring
+    ./replay.py frames.ring --play --speed 2
+'''
+
+import argparse
+import time
+from datetime import datetime
+
+from outputs import TerminalRenderer, read_recording
+from scheduler import RunningStats
+
+
+def percentile(values, fraction:float):
+    '''Returns the value at the given fraction of the sorted values (nearest rank).'''
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def analyse(count:int, records, top:int = 5):
+    '''Returns a dict with the frame rate and the inter-frame gap statistics.'''
+    report = {
+        'frames_written': count,
+        'frames_kept': len(records),
+    }
+    if len(records) < 2:
+        return report
+    gaps = [b.monotonic - a.monotonic for (a, b) in zip(records, records[1:])]
+    stats = RunningStats()
+    for gap in gaps:
+        stats.add(gap)
+    duration = records[-1].monotonic - records[0].monotonic
+    ordered = sorted(gaps)
+    largest = sorted(range(len(gaps)), key=gaps.__getitem__, reverse=True)[:top]
+    report.update({
+        'start': records[0].time,
+        'duration': duration,
+        'fps': len(gaps) / duration if duration > 0 else 0.0,
+        'gaps': stats.as_dict(),
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        # (gap, wall clock time of the frame that ended it)
+        'largest': [(gaps[i], records[i + 1].time) for i in largest],
+    })
+    return report
+
+
+def print_report(report):
+    print('Frames: {frames_written} written, {frames_kept} still in the file'.format(**report))
+    if 'fps' not in report:
+        return
+    gaps = report['gaps']
+    print('Start: {0}, duration: {1:.3f}s, {2:.2f} fps'.format(
+        datetime.fromtimestamp(report['start']).isoformat(sep=' ', timespec='milliseconds'),
+        report['duration'],
+        report['fps'],
+    ))
+    print('Gaps: mean {0:.2f}ms, stdev {1:.2f}ms, min {2:.2f}ms, max {3:.2f}ms'.format(
+        gaps['mean'] * 1000, gaps['stdev'] * 1000, gaps['min'] * 1000, gaps['max'] * 1000,
+    ))
+    print('Gap percentiles: p50 {0:.2f}ms, p95 {1:.2f}ms, p99 {2:.2f}ms'.format(
+        report['p50'] * 1000, report['p95'] * 1000, report['p99'] * 1000,
+    ))
+    print('Largest gaps:')
+    for (gap, when) in report['largest']:
+        print('  {0:10.2f}ms before {1}'.format(
+            gap * 1000,
+            datetime.fromtimestamp(when).isoformat(sep=' ', timespec='milliseconds'),
+        ))
+
+
+def play(records, speed:float = 1.0):
+    '''Draws the frames in the terminal, at their original pace (divided by speed).'''
+    renderer = TerminalRenderer()
+    if not records:
+        return
+    start = time.monotonic()
+    first = records[0].monotonic
+    for record in records:
+        time.sleep(max(0, (record.monotonic - first) / speed - (time.monotonic() - start)))
+        renderer.show(record.frame, record.brightness)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Ring file written by outputs.FrameRecorder')
+    parser.add_argument('--top', type=int, default=5, help='How many of the largest gaps to list')
+    parser.add_argument('--play', action='store_true', help='Play the frames back in the terminal')
+    parser.add_argument('--speed', type=float, default=1.0, help='Playback speed factor')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    (count, records) = read_recording(args.path)
+    if args.play:
+        play(records, args.speed)
+    print_report(analyse(count, records, args.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+'''
+Deadline-based frame scheduler.
+
+Sleeping for `delay` seconds after rendering and transmitting a frame makes
+every frame last a bit longer than intended, and the error accumulates. This
+scheduler computes each deadline from the previous deadline instead, using a
+monotonic clock, so the rendering and GPIO time doesn't make the carousel
+drift.
+
+Frames of aligned views (such as clocks) are scheduled at the wall-clock
+second edges, so the seconds digit flips right after the real tick.
+'''
+
+import math
+import resource
+import time
+
+
+class RunningStats:
+    '''Count, mean, standard deviation, min and max of a series, without storing the values.'''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value:float):
+        # Welford's online algorithm.
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self._m2 / self.count) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'stdev': self.stdev,
+            'min': self.min,
+            'max': self.max,
+        }
+
+
+class FrameScheduler:
+    def __init__(self, clock=time.monotonic, wall_clock=time.time, epsilon:float = 0.001, metrics=None):
+        '''
+        Parameters:
+        clock: Monotonic clock used for the deadlines
+        wall_clock: Clock used to find the second edges for aligned frames
+        epsilon: How long after the second edge the aligned frames are scheduled, so the new second is already visible to datetime.now()
+        metrics: Optional metrics.CarouselMetrics, to record the lateness of each frame
+        '''
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.epsilon = epsilon
+        self.metrics = metrics
+        # Lateness of each frame: how long after its deadline it actually started.
+        self.lateness = RunningStats()
+        self.last_lateness = None
+        self.reset()
+
+    def reset(self):
+        '''Starts a new chain of deadlines from the current frame, e.g. after the carousel was paused.'''
+        self.deadline = None
+        self.frame_start = self.clock()
+
+    def next_deadline(self, delay:float, align:bool = False) -> float:
+        '''Returns (and remembers) the deadline for the frame after the current one.
+
+        The deadline is the previous deadline plus delay. For aligned frames, it is `delay` seconds after the wall-clock second edge just before the current frame started.
+        '''
+        now = self.clock()
+        if align:
+            offset = self.wall_clock() - now
+            wall_start = self.frame_start + offset
+            deadline = math.floor(wall_start) + delay + self.epsilon - offset
+        else:
+            base = self.frame_start if self.deadline is None else self.deadline
+            deadline = base + delay
+            if deadline < now - delay:
+                # Way too late (e.g. the machine was suspended). Restart from now, instead of rushing through the missed frames.
+                deadline = now
+        self.deadline = deadline
+        return deadline
+
+    def frame_started(self) -> float:
+        '''To be called when the next frame starts (i.e. after waiting for the deadline). Returns its lateness.'''
+        self.frame_start = self.clock()
+        if self.deadline is None:
+            return None
+        lateness = self.frame_start - self.deadline
+        self.last_lateness = lateness
+        self.lateness.add(lateness)
+        if self.metrics is not None:
+            self.metrics.lateness_seconds.observe(max(0, lateness))
+        return lateness
+
+    def wait(self, delay:float, align:bool = False, sleep=time.sleep) -> float:
+        '''Blocks until the deadline of the next frame. Returns its lateness.'''
+        deadline = self.next_deadline(delay, align)
+        sleep(max(0, deadline - self.clock()))
+        return self.frame_started()
+
+    def report(self):
+        '''Returns the lateness statistics (in seconds); the stdev is the jitter.'''
+        return self.lateness.as_dict()
+
+
+class IdleMeter:
+    '''Wakeups and CPU time of the whole process (all threads), per minute, to check how much idling costs.
+
+    The wakeups are the voluntary context switches: each time a thread blocked (sleeping, waiting for a lock, an event or a socket) and then ran again.
+    '''
+    def __init__(self, clock=time.monotonic):
+        '''
+        Parameters:
+        clock: Monotonic clock for the elapsed time
+        '''
+        self.clock = clock
+        self.reset()
+
+    @staticmethod
+    def _usage():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return (usage.ru_nvcsw, usage.ru_utime + usage.ru_stime)
+
+    def reset(self):
+        '''Starts a new measurement period.'''
+        self.start = self.clock()
+        (self._wakeups, self._cpu) = self._usage()
+
+    def report(self):
+        '''Returns the wakeups and CPU seconds since the last reset(), in total and per minute.'''
+        seconds = self.clock() - self.start
+        (wakeups, cpu) = self._usage()
+        wakeups -= self._wakeups
+        cpu -= self._cpu
+        minutes = seconds / 60
+        return {
+            'seconds': seconds,
+            'wakeups': wakeups,
+            'cpu_seconds': cpu,
+            'wakeups_per_minute': wakeups / minutes if minutes > 0 else 0.0,
+            'cpu_seconds_per_minute': cpu / minutes if minutes > 0 else 0.0,
+        }
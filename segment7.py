@@ -7,6 +7,8 @@ For some inspiration, see also:
 * https://en.wikipedia.org/wiki/Seven-segment_display
 '''
 
+from functools import lru_cache
+
 char_to_bin_map = {
     '0': 0b0111111,
     '1': 0b0000110,
@@ -146,3 +148,64 @@ def char_to_bin(char):
         if byte is not None:
             return byte
     return 0  # It should never get to this line.
+
+
+# The dot is not a character on its own, it is the eighth segment of the previous digit.
+DOT = 0b_1000_0000
+
+# Placeholder for '.' in the translated text, outside the 0-255 range of the encoded digits.
+_DOT_PLACEHOLDER = '\u0100'
+
+
+# What the chars without a segment pattern turn into.
+_BLANK = chr(char_to_bin(' '))
+
+
+class _TranslateTable(dict):
+    '''Translation table for str.translate(), mapping a char to the encoded digit (as a char).
+
+    Chars not in `char_to_bin_map` are resolved by `char_to_bin()` on first use. Only those that map to something (through their upper or lower case) are remembered: texts come from the network too, and any code point would otherwise grow the table forever.
+    '''
+    def __missing__(self, key):
+        value = chr(char_to_bin(chr(key)))
+        if value != _BLANK:
+            self[key] = value
+        return value
+
+
+def _compile_translate_table():
+    table = _TranslateTable()
+    for char in char_to_bin_map:
+        for guess in (char, char.upper(), char.lower()):
+            if len(guess) == 1:
+                table[ord(guess)] = chr(char_to_bin(guess))
+    table[ord('.')] = _DOT_PLACEHOLDER
+    return table
+
+
+_translate_table = _compile_translate_table()
+
+
+@lru_cache(maxsize=256)
+def encode(text:str) -> bytes:
+    '''Converts a whole string into the bytes to be sent to the display, one byte per digit.
+
+    The dot turns on the decimal point of the previous digit, if it exists and is still off. Otherwise, it takes a digit of its own.
+
+    >>> encode('1.2') == bytes([0b10000110, 0b1011011])
+    True
+    >>> encode('..') == bytes([DOT, DOT])
+    True
+    >>> encode('hello') == bytes(char_to_bin(c) for c in 'hello')
+    True
+    '''
+    parts = text.translate(_translate_table).split(_DOT_PLACEHOLDER)
+    if len(parts) > 1:
+        # Each boundary between two parts is a dot.
+        for i in range(len(parts) - 1):
+            part = parts[i]
+            if part:
+                parts[i] = part[:-1] + chr(ord(part[-1]) | DOT)
+            else:
+                parts[i] = chr(DOT)
+    return ''.join(parts).encode('latin-1')
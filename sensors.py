@@ -0,0 +1,152 @@
+'''
+Shared sampler for the sensor readings shown by the views.
+
+Each metric is read through a callable and cached for a configurable TTL, so
+several views (or several frames of the same view) don't hit the system again
+and again. Sysfs files are kept open and re-read from offset 0 with pread,
+instead of being opened, read and closed on every call.
+
+Optionally, a background thread samples all metrics at a steady rate, which
+feeds the min/max/average over a sliding window.
+'''
+
+import os
+import threading
+from collections import deque
+from time import monotonic
+
+
+class SysfsFile:
+    '''A sysfs (or any other small) file kept open and re-read with pread.
+
+    The file is only opened on the first read, so a missing file fails where it is used.
+    '''
+    def __init__(self, path:str, parse=float, size:int = 64):
+        '''
+        Parameters:
+        path: Path to the file
+        parse: Function to convert the raw contents (bytes) into the value
+        size: Maximum amount of bytes to read
+        '''
+        self.path = path
+        self.parse = parse
+        self.size = size
+        self.fd = None
+
+    def __repr__(self):
+        return 'SysfsFile({0.path!r})'.format(self)
+
+    def read(self):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        return self.parse(os.pread(self.fd, self.size, 0))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _Metric:
+    def __init__(self, read, ttl:float, window:int):
+        self.read = read
+        self.ttl = ttl
+        self.value = None
+        self.timestamp = None
+        # Recent numeric samples, for the min/max/average.
+        self.history = deque(maxlen=window)
+
+
+class Sampler:
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def add(self, name:str, read, ttl:float = 1.0, window:int = 60):
+        '''Adds a metric.
+
+        Parameters:
+        name: Name of the metric
+        read: Function that returns a fresh value
+        ttl: For how many seconds a value is reused
+        window: How many recent samples are kept for summary()
+        '''
+        self._metrics[name] = _Metric(read, ttl, window)
+
+    def _refresh(self, metric, now, record:bool = False):
+        value = metric.read()
+        metric.value = value
+        metric.timestamp = now
+        # Only the steady-rate samples go into the history, not the reads on demand.
+        if record and isinstance(value, (int, float)):
+            metric.history.append(value)
+        return value
+
+    def get(self, name:str):
+        '''Returns the cached value of a metric, reading it again if it is older than its TTL.'''
+        metric = self._metrics[name]
+        with self._lock:
+            now = self.clock()
+            if metric.timestamp is None or now - metric.timestamp >= metric.ttl:
+                return self._refresh(metric, now)
+            return metric.value
+
+    def summary(self, name:str):
+        '''Returns (min, average, max) of the recent samples of a numeric metric, or None if there are none yet.'''
+        metric = self._metrics[name]
+        with self._lock:
+            history = list(metric.history)
+        if not history:
+            return None
+        return (min(history), sum(history) / len(history), max(history))
+
+    def sample_all(self):
+        '''Reads all metrics right away, regardless of their TTL, and adds the values to their history. This is what the background thread does at each tick.'''
+        with self._lock:
+            now = self.clock()
+            for metric in self._metrics.values():
+                try:
+                    self._refresh(metric, now, record=True)
+                except Exception:
+                    # A missing file (OSError) or an unparsable value (ValueError) must not stop the background thread.
+                    # Keep sampling the other metrics; the view will raise when reading this one.
+                    pass
+
+    def _run(self, interval):
+        deadline = self.clock()
+        while not self._stop.is_set():
+            self.sample_all()
+            # Steady rate, regardless of how long the sampling took.
+            deadline = max(deadline + interval, self.clock())
+            self._stop.wait(deadline - self.clock())
+
+    def start(self, interval:float = 1.0):
+        '''Starts sampling all metrics every interval seconds in a background thread.'''
+        if self._thread is not None:
+            raise RuntimeError('The sampler is already running')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='Sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        '''Stops the background thread and closes all the files kept open.'''
+        self.stop()
+        for metric in self._metrics.values():
+            owner = getattr(metric.read, '__self__', None)
+            if isinstance(owner, SysfsFile):
+                owner.close()
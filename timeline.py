@@ -0,0 +1,118 @@
+'''
+Timeline of upcoming events and holidays.
+
+Events are kept sorted by their timestamp, so finding the next event after a
+given moment is a binary search. Recurring rules (a fixed date, an offset from
+Easter, Koningsdag, DST changes...) are functions from a year to a datetime,
+and they are expanded lazily, one year at a time, as the time goes by. The
+timeline never runs dry, and the script doesn't need to be restarted every
+year.
+'''
+
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+
+Event = namedtuple('Event', 'when label')
+
+
+def midnight(d:date, tz) -> datetime:
+    '''Converts a plain date to a datetime at midnight.'''
+    return datetime.combine(d, time.min, tzinfo=tz)
+
+
+def fixed_date(month:int, day:int, tz):
+    '''Rule for a date that is the same every year.'''
+    return lambda year: midnight(date(year, month, day), tz)
+
+
+def easter_offset(days:int, tz):
+    '''Rule for a date relative to Easter Sunday.'''
+    def rule(year):
+        # Imported here, so it only costs something when the rules are expanded.
+        from dateutil.easter import easter
+        return midnight(easter(year) + timedelta(days=days), tz)
+    return rule
+
+
+def koningsdag(tz):
+    '''Rule for Koningsdag: April 27, or April 26 if the 27th is a Sunday.'''
+    def rule(year):
+        d = date(year, 4, 27)
+        if d.weekday() == 6:
+            d = date(year, 4, 26)
+        return midnight(d, tz)
+    return rule
+
+
+def last_sunday(month:int, hour:int, tz):
+    '''Rule for the last Sunday of a month, at a given hour (e.g. European DST changes).'''
+    def rule(year):
+        # The last day of the month.
+        d = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        d -= timedelta(days=(d.weekday() + 1) % 7)
+        return datetime.combine(d, time(hour), tzinfo=tz)
+    return rule
+
+
+class Timeline:
+    def __init__(self, events=(), rules=()):
+        '''
+        Parameters:
+        events: Sequence of (datetime, label) one-off events
+        rules: Sequence of (rule, label), where rule is a function from a year to a datetime
+        '''
+        # Two parallel lists, sorted by timestamp.
+        self._timestamps = []
+        self._events = []
+        self._rules = list(rules)
+        # Rules are expanded for all years up to this one (inclusive).
+        self._expanded_year = None
+        for (when, label) in events:
+            self.add(when, label)
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, when:datetime, label:str):
+        '''Adds a one-off event.'''
+        timestamp = when.timestamp()
+        i = bisect_right(self._timestamps, timestamp)
+        self._timestamps.insert(i, timestamp)
+        self._events.insert(i, Event(when, label))
+
+    def _expand(self, year:int):
+        for (rule, label) in self._rules:
+            self.add(rule(year), label)
+        self._expanded_year = year
+
+    def _expand_until(self, first_year:int, year:int) -> bool:
+        '''Expands the rules up to the given year. Returns whether anything was expanded.
+
+        The first expansion starts at first_year.
+        '''
+        if self._expanded_year is None:
+            self._expanded_year = first_year - 1
+        if self._expanded_year >= year:
+            return False
+        while self._expanded_year < year:
+            self._expand(self._expanded_year + 1)
+        return True
+
+    def next_after(self, now:datetime):
+        '''Returns the first Event strictly after now, or None if there is none.'''
+        # Next year too, so there is always something after the last event of this year.
+        if self._rules and self._expand_until(now.year, now.year + 1):
+            # Once in a while (i.e. once a year), drop the old events.
+            self.forget_before(now)
+        i = bisect_right(self._timestamps, now.timestamp())
+        if i < len(self._events):
+            return self._events[i]
+        return None
+
+    def forget_before(self, now:datetime):
+        '''Drops the events that are already in the past, so the timeline doesn't grow forever.'''
+        i = bisect_right(self._timestamps, now.timestamp())
+        del self._timestamps[:i]
+        del self._events[:i]
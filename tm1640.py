@@ -16,10 +16,17 @@ The datasheet is still available on https://web.archive.org/web/20161020100322/h
 
 import segment7
 import gpiozero
+import logging
+import threading
 import warnings
+from collections import deque
+from concurrent.futures import Future
+from time import perf_counter
 from typing import Callable
 
 
+logger = logging.getLogger(__name__)
+
 def clamp(n, lower, upper):
     '''Clamps/clips a number n into the lower and upper bounds (both inclusive)
     
@@ -41,30 +48,134 @@ def clamp(n, lower, upper):
     return n
 
 
+def no_sleep():
+    '''Default `sleep` for TM1640, doesn't wait at all.'''
+    pass
+
+
+def _pin_writer(device):
+    '''Returns a function that sets the output value of a gpiozero OutputDevice.
+
+    Whenever possible, it writes directly to the underlying pin object, skipping the property machinery of OutputDevice.
+    '''
+    set_state = getattr(device.pin, '_set_state', None)
+    if device.active_high and callable(set_state):
+        return set_state
+    def write(value):
+        device.value = value
+    return write
+
+
+# Indexes into the (clk, din) tuple, used by the edge tables below.
+CLK = 0
+DIN = 1
+
+# Sequences of (pin, value) changes for the start and end conditions.
+_START_EDGES = ((CLK, True), (DIN, True), (DIN, False))
+_END_EDGES = ((CLK, False), (DIN, False), (CLK, True), (DIN, True))
+
+
+def _byte_edges(byte:int, din:int):
+    '''Returns the sequence of (pin, value) changes to send a byte, LSB first.
+
+    The DIN pin is only written if its value changes, and `din` is its value before this byte. The CLK pin is left high, the next byte (or the end condition) pulls it low.
+    '''
+    edges = []
+    for i in range(8):
+        bit = (byte >> i) & 1
+        edges.append((CLK, False))
+        if bit != din:
+            edges.append((DIN, bool(bit)))
+            din = bit
+        edges.append((CLK, True))
+    return tuple(edges)
+
+
+# Precomputed edge sequences for all 256 bytes, indexed by [din][byte], where din is the DIN value before the byte.
+_BYTE_EDGES = tuple(
+    tuple(_byte_edges(byte, din) for byte in range(256))
+    for din in (0, 1)
+)
+# How many pin changes each of the sequences above has.
+_BYTE_EDGE_COUNTS = tuple(
+    tuple(len(edges) for edges in table)
+    for table in _BYTE_EDGES
+)
+
+
+def count_edges(data) -> int:
+    '''Returns how many pin changes it takes to send a whole command (start condition, data bytes, end condition).
+
+    >>> count_edges([0b_0100_0000])
+    22
+    '''
+    # The start condition only pulls DIN low, as both pins are already high.
+    edges = 1
+    din = 0
+    for byte in data:
+        edges += _BYTE_EDGE_COUNTS[din][byte]
+        din = byte >> 7
+    # The end condition pulls CLK low, DIN low (if it isn't yet), then both high.
+    return edges + 3 + din
+
+
 # NOTE: I could try subclassing some class from gpiozero.
 # If it works well, I could event try submitting it upstream.
 # But, for now, no subclassing.
 
 class TM1640:
-    def __init__(self, clk_pin:int, din_pin:int, sleep:Callable = lambda:None, pin_factory=None):
+    # Size of the display RAM.
+    digits = 16
+
+    def __init__(self, clk_pin:int, din_pin:int, sleep:Callable = no_sleep, pin_factory=None, metrics=None, outputs=()):
         '''
         Parameters:
         clk_pin: The RPi GPIO pin number for SCLK
         din_pin: The RPi GPIO pin number for DIN
         sleep: A function to sleep between each pin output value change
         pin_factory: Parameter passed to gpiozero constructors
+        metrics: Optional metrics.DisplayMetrics, updated on every transmission
+        outputs: Additional outputs (see outputs.py) that receive what is on the display after every transmission
         
-        Regarding `sleep` parameter: Technically, the code has to wait a few microseconds between each pin state change. The datasheet says the TM1640 chip has an oscillation frequency of 450MHz, and a maximum clock frequency of 1MHz. However, given this is interpreted Python code running on Raspberry Pi, the amount of time between one state change statement and the next one is already long enough, so we don't need to wait, in practice.
+        Regarding `sleep` parameter: Technically, the code has to wait a few microseconds between each pin state change. The datasheet says the TM1640 chip has an oscillation frequency of 450MHz, and a maximum clock frequency of 1MHz. However, given this is interpreted Python code running on Raspberry Pi, the amount of time between one state change statement and the next one is already long enough, so we don't need to wait, in practice. To be sure, bus_timing.calibrate() measures it and picks a suitable `sleep`.
         '''
         self.clk_pin = clk_pin
         self.din_pin = din_pin
-        self.clk = gpiozero.OutputDevice(self.clk_pin, initial_value=True, pin_factory=pin_factory)
-        self.din = gpiozero.OutputDevice(self.din_pin, initial_value=True, pin_factory=pin_factory)
         self.sleep = sleep
-        
+        self.metrics = metrics
+        self.outputs = tuple(outputs)
+        self._open_pins(pin_factory)
+
         self._brightness = None  # It's unknown at this time.
+        # Brightness to be sent together with the next frame, see defer_brightness().
+        self._pending_brightness = None
+        # Shadow copy of the display RAM. None means the value is unknown.
+        self._ram = [None] * self.digits
+        self._fixed_address = None  # It's unknown at this time.
+        # Statistics, so we can see how much is actually being sent over the wire.
+        self.bytes_sent = 0
+        self.last_frame_bytes = 0
+        # Frames that changed something on the display.
+        self.frames_written = 0
         self._command1_data()
 
+    def _open_pins(self, pin_factory):
+        self.clk = gpiozero.OutputDevice(self.clk_pin, initial_value=True, pin_factory=pin_factory)
+        self.din = gpiozero.OutputDevice(self.din_pin, initial_value=True, pin_factory=pin_factory)
+        self._write_clk = _pin_writer(self.clk)
+        self._write_din = _pin_writer(self.din)
+        # The edge tables, bound to the pins of this instance.
+        self._edges = tuple(
+            tuple(
+                tuple(
+                    ((self._write_clk, self._write_din)[pin], value)
+                    for (pin, value) in byte_edges
+                )
+                for byte_edges in table
+            )
+            for table in _BYTE_EDGES
+        )
+
     def __repr__(self):
         # Note: this is not a 100% representation of this object, because the sleep parameter is omitted. However, it's close enough, and it's sufficient for most purposes.
         return 'TM1640(clk_pin={0.clk_pin}, din_pin={0.din_pin})'.format(self)
@@ -79,37 +190,42 @@ class TM1640:
         self.clk.close()
         self.din.close()
 
-    # Low-level communication with the device: send_start, send_byte, send_end
-    def _send_start(self):
-        self.clk.on()
-        self.sleep()
-        self.din.on()
-        self.sleep()
-        self.din.off()
-        self.sleep()
-
-    def _send_end(self):
-        self.clk.off()
-        self.sleep()
-        self.din.off()
-        self.sleep()
-        self.clk.on()
-        self.sleep()
-        self.din.on()
-        self.sleep()
-
-    def _send_byte(self, byte:int):
-        for i in range(8):
-            bit = byte & 1
-            byte >>= 1
-            self.clk.off()
-            self.sleep()
-            self.din.value = bit
-            self.sleep()
-            self.clk.on()
-            self.sleep()
-        self.clk.off()
-        self.sleep()
+    # Low-level communication with the device.
+    #
+    # Each command is a start condition, a few bytes and an end condition. Instead of computing the pin changes bit by bit, we replay the precomputed edge sequences from `_START_EDGES`, `_BYTE_EDGES` and `_END_EDGES`.
+    def _send(self, data):
+        clk_din = (self._write_clk, self._write_din)
+        edges = self._edges
+        sleep = self.sleep
+        din = 0  # DIN is low right after the start condition.
+        if sleep is no_sleep:
+            for (pin, value) in _START_EDGES:
+                clk_din[pin](value)
+            for byte in data:
+                for (write, value) in edges[din][byte]:
+                    write(value)
+                din = byte >> 7
+            for (pin, value) in _END_EDGES:
+                clk_din[pin](value)
+        else:
+            for (pin, value) in _START_EDGES:
+                clk_din[pin](value)
+                sleep()
+            for byte in data:
+                for (write, value) in edges[din][byte]:
+                    write(value)
+                    sleep()
+                din = byte >> 7
+            for (pin, value) in _END_EDGES:
+                clk_din[pin](value)
+                sleep()
+        self.bytes_sent += len(data)
+        if self.metrics is not None:
+            self._count_edges(data)
+
+    def _count_edges(self, data):
+        self.metrics.bytes.inc(len(data))
+        self.metrics.edges.inc(count_edges(data))
 
     def _command1_data(self, fixed_address:bool = False):
         # Bits:
@@ -122,9 +238,30 @@ class TM1640:
         byte = 0b_0100_0000
         if fixed_address:
             byte |= 0b_0000_0100
-        self._send_start()
-        self._send_byte(byte)
-        self._send_end()
+        self._send((byte,))
+        self._fixed_address = fixed_address
+
+    def send_data_command(self, repeat:int = 1):
+        '''Sends the data command (auto-increment address mode) repeat times. It changes nothing on the display.
+
+        Used to measure the bus (see bus_timing.py). This traffic is not counted in `bytes_sent` nor in the metrics.
+        '''
+        metrics = self.metrics
+        bytes_sent = self.bytes_sent
+        self.metrics = None
+        try:
+            for i in range(repeat):
+                self._command1_data(fixed_address=False)
+        finally:
+            self.metrics = metrics
+            self.bytes_sent = bytes_sent
+
+    def clock_writer(self):
+        '''Returns the function that sets the CLK pin (to True or False) in the transmissions, to measure how long a pin change takes (see bus_timing.py).
+
+        The chip ignores CLK changes while DIN is high, outside of a command; CLK must be left high.
+        '''
+        return self._write_clk
 
     # FIXME: Type annotation should mention "bytes" OR "sequence of integers"
     def _command2_address(self, payload:bytes, address:int = 0):
@@ -135,13 +272,9 @@ class TM1640:
         # B3-B0: the address, from 0 to 15 (there are 16 digits)
         # x: Other bits are unused and must be zero
         byte = 0b_1100_0000 | (address & 0b_0000_1111)
-        self._send_start()
-        self._send_byte(byte)
         if len(payload) > 16:
             warnings.warn('The payload must be at most 16 bytes, received {0} bytes'.format(len(payload)))
-        for b in payload[:16]:
-            self._send_byte(b)
-        self._send_end()
+        self._send((byte, *payload[:16]))
 
     def _command3_display_control(self, display_on:bool = True, brightness:int = 0):
         # Bits:
@@ -162,9 +295,7 @@ class TM1640:
         byte = 0b_1000_0000 | (brightness & 0b_0000_0111)
         if display_on:
             byte |= 0b_0000_1000
-        self._send_start()
-        self._send_byte(byte)
-        self._send_end()
+        self._send((byte,))
 
     @property
     def brightness(self):
@@ -176,34 +307,505 @@ class TM1640:
 
     @brightness.setter
     def brightness(self, value):
-        self._brightness = clamp(int(value), 0, 8)
+        if self._change_brightness(value) and self.outputs:
+            self._notify_outputs()
+
+    def _change_brightness(self, value) -> bool:
+        '''Sends the brightness if it changed, returns whether it did.'''
+        value = clamp(int(value), 0, 8)
+        self._pending_brightness = None
+        if value == self._brightness:
+            # Nothing changed, no need to bother the chip.
+            return False
+        self._brightness = value
         self._command3_display_control(
             display_on=bool(self._brightness),
             brightness=self._brightness - 1,
         )
+        return True
+
+    def defer_brightness(self, value):
+        '''Sets the brightness together with the next frame, instead of right away.
+
+        Useful for fades: a brightness step that is due at about the same time as a frame is sent in the same burst, right after it.
+        '''
+        self._pending_brightness = clamp(int(value), 0, 8)
+
+    def _apply_pending_brightness(self):
+        if self._pending_brightness is not None:
+            self._change_brightness(self._pending_brightness)
+
+    def _notify_outputs(self):
+        # Unknown digits are shown as blank.
+        frame = bytes(b or 0 for b in self._ram)
+        brightness = self._brightness or 0
+        for output in self.outputs:
+            output.show(frame, brightness)
+
+    def invalidate(self):
+        '''Forgets the shadow copy of the display RAM and the last brightness.
+
+        The next write will send everything again. Useful if the display was power-cycled or was written by someone else.
+        '''
+        self._ram = [None] * self.digits
+        self._brightness = None
+        self._fixed_address = None
+
+    def _set_address_mode(self, dirty) -> bool:
+        '''Given the sorted list of changed addresses, switches to the cheapest address mode and returns whether it is the fixed address mode.'''
+        # Costs in bytes, including the data command when switching modes.
+        range_cost = 1 + (dirty[-1] - dirty[0] + 1) + (0 if self._fixed_address is False else 1)
+        fixed_cost = 2 * len(dirty) + (0 if self._fixed_address is True else 1)
+        fixed_address = fixed_cost < range_cost
+        if self._fixed_address is not fixed_address:
+            self._command1_data(fixed_address=fixed_address)
+        return fixed_address
 
     # FIXME: Type annotation should mention "bytes" OR "sequence of integers"
-    def write_bytes(self, payload:bytes, address:int = 0):
-        self._command2_address(payload, address)
+    def write_bytes(self, payload:bytes, address:int = 0) -> int:
+        '''Writes the payload into the display RAM, starting at address.
+
+        A shadow copy of the display RAM is kept, and only the changed digits are sent. Either the smallest changed range is sent (in auto-increment address mode), or each changed digit is sent individually (in fixed address mode), whichever is shorter.
+
+        Returns how many bytes were actually sent over the wire (also available as `last_frame_bytes`).
+        '''
+        address &= 0b_0000_1111
+        # Raises ValueError for values outside 0 to 255, which have no edge table.
+        payload = bytes(payload)
+        if len(payload) > 16 - address:
+            warnings.warn('The payload must be at most {0} bytes, received {1} bytes'.format(16 - address, len(payload)))
+            payload = payload[:16 - address]
+
+        metrics = self.metrics
+        if metrics is not None:
+            start = perf_counter()
+
+        ram = self._ram
+        dirty = [
+            i for (i, b) in enumerate(payload, address)
+            if ram[i] != b
+        ]
+        before = self.bytes_sent
+        if dirty:
+            lo = dirty[0]
+            hi = dirty[-1]
+            if self._set_address_mode(dirty):
+                for i in dirty:
+                    self._command2_address([payload[i - address]], i)
+            else:
+                self._command2_address(payload[lo - address:hi - address + 1], lo)
+            for (i, b) in enumerate(payload, address):
+                ram[i] = b
+        self._apply_pending_brightness()
+        self.last_frame_bytes = self.bytes_sent - before
+        if dirty:
+            self.frames_written += 1
+        if self.last_frame_bytes and self.outputs:
+            self._notify_outputs()
+        # A write with nothing to send isn't a frame on the wire.
+        if metrics is not None and self.last_frame_bytes:
+            metrics.frames.inc()
+            metrics.transmit_seconds.observe(perf_counter() - start)
+        return self.last_frame_bytes
 
     # Ideas:
     # We can try mapping one char to two digits. It may or may not look good.
-    # We should move this conversion from string to bytes into segment7.py
-    def write_text(self, text:str, address:int = 0):
-        payload = [0] * 16
-        i = 0
-        for c in text:
-            if i >= len(payload):
-                warnings.warn('Text is longer than the display.')
-                break
-            if c == '.':
-                # Special handling for the dot.
-                # It turns on the dot on the previous character, if it exists and is still off.
-                if i == 0 or (payload[i - 1] & 0b_1000_0000):
-                    i += 1
-                payload[i - 1] |= 0b_1000_0000
+    def write_text(self, text:str, address:int = 0) -> int:
+        size = 16 - (address & 0b_0000_1111)
+        payload = segment7.encode(text)
+        if len(payload) > size:
+            warnings.warn('Text is longer than the display.')
+            payload = payload[:size]
+        return self.write_bytes(payload.ljust(size, b'\0'), address)
+
+
+# The bits of each byte, LSB first.
+_BYTE_BITS = tuple(
+    tuple((byte >> i) & 1 for i in range(8))
+    for byte in range(256)
+)
+
+
+class MultiTM1640(TM1640):
+    '''Several TM1640 displays sharing the same CLK pin, each one with its own DIN pin.
+
+    All DIN pins are set before each clock edge, so all displays are updated in a single bit-banged pass, instead of one after another. The displays behave as a single wide display of 16 × N digits, the first DIN pin being the leftmost display.
+
+    Commands (data, address mode, brightness) are always sent to all displays at once, so the brightness is the same for all of them.
+    '''
+    def __init__(self, clk_pin:int, din_pins, sleep:Callable = no_sleep, pin_factory=None, metrics=None, outputs=()):
+        '''
+        Parameters:
+        clk_pin: The RPi GPIO pin number for the shared SCLK
+        din_pins: Sequence of RPi GPIO pin numbers for DIN, one per display
+        sleep: A function to sleep between each pin output value change
+        pin_factory: Parameter passed to gpiozero constructors
+        metrics: Optional metrics.DisplayMetrics, updated on every transmission (the edges of all pins are counted)
+        outputs: Additional outputs (see outputs.py) that receive the combined frame after every transmission
+        '''
+        self.din_pins = tuple(din_pins)
+        self.count = len(self.din_pins)
+        if self.count == 0:
+            raise ValueError('At least one DIN pin is required')
+        self.digits = 16 * self.count
+        # What should be on the displays; the shadow copy of what was actually sent is `_ram`, as in TM1640.
+        self._frame = bytearray(self.digits)
+        # `din_pin` is the DIN pin of the leftmost display.
+        super().__init__(clk_pin, self.din_pins[0], sleep=sleep, pin_factory=pin_factory, metrics=metrics, outputs=outputs)
+
+    def _open_pins(self, pin_factory):
+        self.clk = gpiozero.OutputDevice(self.clk_pin, initial_value=True, pin_factory=pin_factory)
+        self.dins = []
+        try:
+            for pin in self.din_pins:
+                self.dins.append(gpiozero.OutputDevice(pin, initial_value=True, pin_factory=pin_factory))
+        except Exception:
+            self.close()
+            raise
+        self._write_clk = _pin_writer(self.clk)
+        self._write_dins = tuple(_pin_writer(din) for din in self.dins)
+
+    def __repr__(self):
+        return 'MultiTM1640(clk_pin={0.clk_pin}, din_pins={0.din_pins})'.format(self)
+
+    def close(self):
+        self.clk.close()
+        for din in self.dins:
+            din.close()
+
+    def _send(self, data):
+        # Commands are the same for all displays.
+        self._send_columns([(byte,) * self.count for byte in data])
+
+    def _send_columns(self, columns):
+        '''Sends a whole command, where each column has one byte for each display.'''
+        write_clk = self._write_clk
+        write_dins = self._write_dins
+        sleep = self.sleep
+        pause = sleep is not no_sleep
+        dins = range(self.count)
+
+        # Start condition: all DIN go low while CLK is high.
+        write_clk(True)
+        if pause: sleep()
+        for d in dins:
+            write_dins[d](True)
+        if pause: sleep()
+        for d in dins:
+            write_dins[d](False)
+        if pause: sleep()
+        state = [0] * self.count
+
+        for column in columns:
+            bits = [_BYTE_BITS[byte] for byte in column]
+            for i in range(8):
+                write_clk(False)
+                if pause: sleep()
+                for d in dins:
+                    bit = bits[d][i]
+                    if bit != state[d]:
+                        write_dins[d](bool(bit))
+                        state[d] = bit
+                if pause: sleep()
+                write_clk(True)
+                if pause: sleep()
+
+        # End condition: CLK low, all DIN low, CLK high, then all DIN high.
+        write_clk(False)
+        if pause: sleep()
+        for d in dins:
+            write_dins[d](False)
+        if pause: sleep()
+        write_clk(True)
+        if pause: sleep()
+        for d in dins:
+            write_dins[d](True)
+        if pause: sleep()
+        self.bytes_sent += len(columns)
+        if self.metrics is not None:
+            self._count_column_edges(columns)
+
+    def _count_column_edges(self, columns):
+        # Each display on its own would take count_edges() of its bytes, but the CLK changes (16 per byte, plus 2 in the end condition) are shared.
+        shared_clk = 16 * len(columns) + 2
+        edges = sum(count_edges(data) for data in zip(*columns)) - (self.count - 1) * shared_clk
+        self.metrics.bytes.inc(len(columns))
+        self.metrics.edges.inc(edges)
+
+    def _command2_columns(self, address:int, columns):
+        # Same as _command2_address, but with different data for each display.
+        byte = 0b_1100_0000 | (address & 0b_0000_1111)
+        self._send_columns([(byte,) * self.count, *columns])
+
+    def write_bytes(self, payload:bytes, address:int = 0) -> int:
+        '''Writes the payload into the combined framebuffer, starting at address (from 0 to 16 × N - 1).
+
+        Only the changed digits are sent, with the same strategy as TM1640.write_bytes. As the clock is shared, the displays always receive the same addresses; a display without changes there just receives its current contents again.
+
+        Returns how many bytes were actually sent over the wire (also available as `last_frame_bytes`).
+        '''
+        size = len(self._frame)
+        if not 0 <= address < size:
+            raise ValueError('The address must be between 0 and {0}, received {1}'.format(size - 1, address))
+        if len(payload) > size - address:
+            warnings.warn('The payload must be at most {0} bytes, received {1} bytes'.format(size - address, len(payload)))
+            payload = payload[:size - address]
+        self._frame[address:address + len(payload)] = bytes(payload)
+        metrics = self.metrics
+        if metrics is None:
+            return self._flush()
+        start = perf_counter()
+        sent = self._flush()
+        if sent:
+            metrics.frames.inc()
+            metrics.transmit_seconds.observe(perf_counter() - start)
+        return sent
+
+    def _flush(self) -> int:
+        frame = self._frame
+        ram = self._ram
+        offsets = range(0, len(frame), 16)
+        # Addresses (0 to 15) that changed in at least one display.
+        dirty = [
+            a for a in range(16)
+            if any(ram[o + a] != frame[o + a] for o in offsets)
+        ]
+        before = self.bytes_sent
+        if dirty:
+            lo = dirty[0]
+            hi = dirty[-1]
+            if self._set_address_mode(dirty):
+                for a in dirty:
+                    self._command2_columns(a, [tuple(frame[o + a] for o in offsets)])
             else:
-                b = segment7.char_to_bin(c)
-                payload[i] = b
-                i += 1
-        self._command2_address(payload, address)
+                self._command2_columns(lo, [tuple(frame[o + a] for o in offsets) for a in range(lo, hi + 1)])
+                dirty = range(lo, hi + 1)
+            for a in dirty:
+                for o in offsets:
+                    ram[o + a] = frame[o + a]
+            self.frames_written += 1
+        self._apply_pending_brightness()
+        self.last_frame_bytes = self.bytes_sent - before
+        if self.last_frame_bytes and self.outputs:
+            self._notify_outputs()
+        return self.last_frame_bytes
+
+    def write_text(self, text:str, address:int = 0) -> int:
+        size = len(self._frame) - address
+        payload = segment7.encode(text)
+        if len(payload) > size:
+            warnings.warn('Text is longer than the display.')
+            payload = payload[:size]
+        return self.write_bytes(payload.ljust(size, b'\0'), address)
+
+
+class ThreadedTM1640:
+    '''Front-end for TM1640 that talks to the display from a background thread.
+
+    It has the same interface as TM1640 (write_text, write_bytes, brightness, close), but none of those methods block on GPIO. The TM1640 object is created and used exclusively by a dedicated thread.
+
+    Frames go into a mailbox with one slot per address: a frame that hasn't been sent yet is dropped when a newer frame for the same address comes in, and the newer one goes to the end of the queue. Brightness changes (and deferred brightness changes) have a slot each too. Everything is sent in the order it was written, so a frame written before a brightness change is shown before it, unless a newer frame replaced it; and the mailbox never grows beyond a handful of items, whatever the pattern of writes.
+
+    If a write fails, the error is logged and the writer thread carries on with the next one, from an unknown display state (see TM1640.invalidate()). close() reports the failures.
+
+    A frame (or brightness) identical to what the display will show once the mailbox is empty is dropped right away, so the writer thread isn't even woken up for it.
+    '''
+    def __init__(self, *args, **kwargs):
+        '''All parameters are passed to the TM1640 constructor.'''
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._busy = True  # Until the thread has set up the pins.
+        self._closing = False
+        # The error that stopped the writer thread, e.g. the pins couldn't be set up.
+        self._error = None
+        # How many writes failed, and the last of their errors.
+        self.failures = 0
+        self.last_failure = None
+        self._brightness = None
+        # The display RAM as it will be once everything queued is sent; None for unknown digits.
+        self._ram = [None] * 16
+        # Whether a deferred brightness is waiting for the next frame.
+        self._deferred = False
+        self.display = None
+        # The last bus_timing.BusTiming, see calibrate().
+        self.timing = None
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(args, kwargs),
+            name='TM1640 writer',
+            daemon=True,
+        )
+        self._thread.start()
+        # Wait until the pins are set up, so errors are raised right here.
+        self.flush()
+
+    def __repr__(self):
+        return 'ThreadedTM1640({0!r})'.format(self.display)
+
+    # Context manager support:
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _run(self, args, kwargs):
+        try:
+            self.display = TM1640(*args, **kwargs)
+            while True:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+                    while not self._queue and not self._closing:
+                        self._cond.wait()
+                    if not self._queue:
+                        break
+                    (method, args, key) = self._queue.popleft()
+                    self._busy = True
+                try:
+                    method(*args)
+                except Exception as e:
+                    logger.exception('Writing to the display failed')
+                    # Whatever was half sent, the display state is unknown now.
+                    self.display.invalidate()
+                    with self._cond:
+                        # Also on this side: writing the same frame or brightness again must not be dropped as unchanged.
+                        self._ram = [None] * 16
+                        self._brightness = None
+                        self.failures += 1
+                        self.last_failure = e
+        except Exception as e:
+            self._error = e
+        finally:
+            if self.display is not None:
+                self.display.close()
+            with self._cond:
+                self._queue.clear()
+                self._busy = False
+                self._closing = True
+                self._cond.notify_all()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError('The TM1640 writer thread has failed') from self._error
+
+    def _put(self, method, args, key=None, merge=None):
+        '''Queues method(*args) for the writer thread.
+
+        A pending item with the same key (not None) is dropped: the latest one wins. If given, merge(old_args, args) returns the args combining both.
+        '''
+        with self._cond:
+            self._check_error()
+            if self._closing:
+                raise RuntimeError('The TM1640 writer thread is closed')
+            queue = self._queue
+            if key is not None:
+                for (i, item) in enumerate(queue):
+                    if item[2] == key:
+                        del queue[i]
+                        if merge is not None:
+                            args = merge(item[1], args)
+                        break
+            queue.append((method, args, key))
+            self._cond.notify_all()
+
+    def flush(self):
+        '''Blocks until everything written so far has been sent to the display.'''
+        with self._cond:
+            while self._queue or self._busy:
+                self._cond.wait()
+        self._check_error()
+
+    def close(self):
+        '''Sends whatever is still pending, then stops the thread and releases the pins.'''
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._check_error()
+        if self.failures:
+            raise RuntimeError('{0} writes to the display failed'.format(self.failures)) from self.last_failure
+
+    @property
+    def frames_written(self):
+        '''Frames actually sent to the display by the writer thread so far (see TM1640.frames_written).'''
+        display = self.display
+        return display.frames_written if display is not None else 0
+
+    def _set_brightness(self, value):
+        self.display.brightness = value
+
+    @property
+    def brightness(self):
+        '''The latest requested brightness, which may not have been sent yet.'''
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        value = clamp(int(value), 0, 8)
+        with self._cond:
+            if value == self._brightness and not self._deferred:
+                self._check_error()
+                return
+            self._brightness = value
+            self._deferred = False
+            self._put(self._set_brightness, (value,), 'brightness')
+
+    def _defer_brightness(self, value):
+        self.display.defer_brightness(value)
+
+    def defer_brightness(self, value):
+        '''Same as TM1640.defer_brightness(), the brightness is sent together with the next frame.'''
+        with self._cond:
+            self._brightness = clamp(int(value), 0, 8)
+            self._deferred = True
+            self._put(self._defer_brightness, (self._brightness,), 'defer_brightness')
+
+    def _calibrate(self, kwargs, future):
+        # Imported here, as bus_timing imports this module.
+        from bus_timing import calibrate
+        try:
+            future.set_result(calibrate(self.display, **kwargs))
+        except Exception as e:
+            # Raised by calibrate() instead. A command may have been cut short: the address mode is unknown.
+            self.display.invalidate()
+            future.set_exception(e)
+
+    def calibrate(self, **kwargs):
+        '''Runs bus_timing.calibrate() in the writer thread, and returns the BusTiming. Raises whatever bus_timing.calibrate() raised.'''
+        future = Future()
+        self._put(self._calibrate, (kwargs, future))
+        self.flush()
+        self.timing = future.result(0)
+        return self.timing
+
+    def _write_bytes(self, payload, address):
+        self.display.write_bytes(payload, address)
+
+    @staticmethod
+    def _merge_frames(old_args, new_args):
+        # A shorter frame at the same address must not lose the end of the pending one.
+        (old, address) = old_args
+        (new, address) = new_args
+        return (new + old[len(new):], address)
+
+    def write_bytes(self, payload:bytes, address:int = 0):
+        payload = bytes(payload)
+        start = address & 0b_0000_1111
+        # Same truncation as TM1640.write_bytes(), which warns about it.
+        digits = list(payload[:16 - start])
+        with self._cond:
+            if self._ram[start:start + len(digits)] == digits and not self._deferred:
+                self._check_error()
+                return
+            self._ram[start:start + len(digits)] = digits
+            self._deferred = False
+            self._put(self._write_bytes, (payload, address), address, self._merge_frames)
+
+    def write_text(self, text:str, address:int = 0):
+        # Encoded here, so identical frames can be dropped right away.
+        size = 16 - (address & 0b_0000_1111)
+        payload = segment7.encode(text)
+        if len(payload) > size:
+            warnings.warn('Text is longer than the display.')
+            payload = payload[:size]
+        self.write_bytes(payload.ljust(size, b'\0'), address)
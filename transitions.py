@@ -0,0 +1,166 @@
+'''
+Animated transitions between two frames of the carousel.
+
+All the intermediate frames are computed up front as bytes, from the encoded
+outgoing and incoming frames, so playing a transition back is only a matter
+of writing them at the right time. Like the marquee, the position is derived
+from a monotonic clock: if a frame is late, the next ones are skipped so the
+transition keeps its duration. Frames identical to the one before them are
+not written at all, and there is no wakeup for them: the playback sleeps
+straight until the next frame that changes something. Each playback reports
+the frame rate it actually achieved, and how much of the frame budget the
+slowest write used.
+
+The frame rate counts the frames that actually reached the display (see
+TM1640.frames_written): with a ThreadedTM1640, a frame the writer thread
+couldn't keep up with is replaced in its mailbox by the next one, and never
+shown. The frames left out because they change nothing aren't counted either,
+so an effect that changes few digits has a lower frame rate than its target,
+without any frame being late (see `unchanged` and `skipped`).
+'''
+
+import random
+from collections import namedtuple
+from time import monotonic, perf_counter, sleep
+
+
+TransitionStats = namedtuple('TransitionStats', 'effect frames skipped unchanged seconds fps max_write_seconds budget_used')
+
+
+def wipe(old:bytes, new:bytes, count:int):
+    '''The new frame replaces the old one digit by digit, from left to right.'''
+    width = len(new)
+    frames = []
+    for k in range(1, count + 1):
+        i = round(width * k / count)
+        frames.append(new[:i] + old[i:])
+    return frames
+
+
+def slide(old:bytes, new:bytes, count:int):
+    '''The old frame is pushed out to the left by the new one.'''
+    width = len(new)
+    both = old + new
+    return [both[i:i + width] for i in (round(width * k / count) for k in range(1, count + 1))]
+
+
+def dissolve(old:bytes, new:bytes, count:int, seed=None):
+    '''The segments that differ are switched one by one, in random order.'''
+    segments = [
+        (i, 1 << bit)
+        for i in range(len(new))
+        for bit in range(8)
+        if (old[i] ^ new[i]) & (1 << bit)
+    ]
+    random.Random(seed).shuffle(segments)
+    frame = bytearray(old)
+    frames = []
+    done = 0
+    for k in range(1, count + 1):
+        until = round(len(segments) * k / count)
+        for (i, mask) in segments[done:until]:
+            frame[i] ^= mask
+        done = until
+        frames.append(bytes(frame))
+    return frames
+
+
+EFFECTS = {
+    'wipe': wipe,
+    'slide': slide,
+    'dissolve': dissolve,
+}
+
+
+class Transition:
+    def __init__(self, old:bytes, new:bytes, effect:str = 'slide', duration:float = 0.3, fps:float = 50):
+        '''
+        Parameters:
+        old: The encoded frame on the display (see carousel.encode_frame)
+        new: The encoded frame to show, of the same length
+        effect: Name of the effect, one of EFFECTS
+        duration: Duration of the transition, in seconds
+        fps: Target frame rate
+        '''
+        if len(old) != len(new):
+            raise ValueError('The frames must have the same length, received {0} and {1} bytes'.format(len(old), len(new)))
+        self.effect = effect
+        self.fps = fps
+        count = max(1, round(duration * fps))
+        self.frames = tuple(EFFECTS[effect](bytes(old), bytes(new), count))
+        # For each frame, the index of the next frame that is different; len(frames) if there is none.
+        self._next_change = [count] * count
+        for n in range(count - 2, -1, -1):
+            self._next_change[n] = n + 1 if self.frames[n + 1] != self.frames[n] else self._next_change[n + 1]
+        # The first frame different from the old one.
+        self._first = 0 if self.frames[0] != bytes(old) else self._next_change[0]
+        # Frames that change nothing, and are never written.
+        self.unchanged = self._first + sum(1 for n in range(self._first + 1, count) if self.frames[n] == self.frames[n - 1])
+
+    def __repr__(self):
+        return 'Transition({0.effect!r}, frames={1}, fps={0.fps})'.format(self, len(self.frames))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def timeline(self, clock=monotonic):
+        '''Yields (index, deadline) tuples: write self.frames[index], then wait until the deadline (in clock() time).
+
+        The frames identical to the one before them are left out, the deadline is when the next different frame is due. If the consumer is late, frames are skipped; the last frame that changes something is never skipped.
+        '''
+        count = len(self.frames)
+        start = clock()
+        n = self._first
+        while n < count:
+            following = self._next_change[n]
+            yield (n, start + following / self.fps)
+            n = max(following, min(count - 1, int((clock() - start) * self.fps)))
+
+    def _stats(self, display, written_before, written:int, seconds:float, max_write:float):
+        if written_before is not None:
+            # Counted by the display itself, e.g. by the writer thread of a ThreadedTM1640.
+            written = display.frames_written - written_before
+        return TransitionStats(
+            effect=self.effect,
+            frames=written,
+            skipped=max(0, len(self.frames) - written - self.unchanged),
+            unchanged=self.unchanged,
+            seconds=seconds,
+            fps=written / seconds if seconds > 0 else 0.0,
+            max_write_seconds=max_write,
+            budget_used=max_write * self.fps,
+        )
+
+    def play(self, display, clock=monotonic, sleep=sleep) -> TransitionStats:
+        '''Plays the transition on the display, blocking until it is done. Returns the achieved frame rate and timings.
+
+        With a ThreadedTM1640, the write times are only the time to queue the frames.
+        '''
+        written_before = getattr(display, 'frames_written', None)
+        start = clock()
+        written = 0
+        max_write = 0.0
+        for (n, deadline) in self.timeline(clock):
+            before = perf_counter()
+            display.write_bytes(self.frames[n])
+            max_write = max(max_write, perf_counter() - before)
+            written += 1
+            sleep(max(0, deadline - clock()))
+        return self._stats(display, written_before, written, clock() - start, max_write)
+
+    async def play_async(self, display) -> TransitionStats:
+        '''Same as play(), but for an asyncio loop.'''
+        # Only the daemon needs asyncio, it is slow to import on the Pi.
+        import asyncio
+        loop = asyncio.get_running_loop()
+        written_before = getattr(display, 'frames_written', None)
+        start = loop.time()
+        written = 0
+        max_write = 0.0
+        for (n, deadline) in self.timeline(loop.time):
+            before = perf_counter()
+            display.write_bytes(self.frames[n])
+            max_write = max(max_write, perf_counter() - before)
+            written += 1
+            await asyncio.sleep(max(0, deadline - loop.time()))
+        return self._stats(display, written_before, written, loop.time() - start, max_write)
@@ -0,0 +1,128 @@
+'''
+Live mirror of the display over WebSocket.
+
+WebSocketMirror is a TM1640 output (see outputs.py): every transmitted frame
+is serialized once into a compact binary message, the brightness byte
+followed by the frame bytes, and broadcast to all the connected clients.
+
+The TM1640 writer thread only hands the message over to the asyncio loop, it
+never waits for the network. Each client has its own small queue; a client
+that falls behind has its queue dropped down to the latest frame, so a slow
+browser neither holds up the display nor the other clients.
+
+Clients can also push frames in: a binary message is a raw payload of up to
+16 bytes, a text message is a text, both shown like POST /bytes and /text.
+'''
+
+import asyncio
+from collections import deque
+from aiohttp import WSCloseCode, WSMsgType, web
+
+
+def encode_message(frame:bytes, brightness:int) -> bytes:
+    '''
+    >>> encode_message(b'\\x3f\\x06', 8)
+    b'\\x08?\\x06'
+    '''
+    return bytes((brightness,)) + frame
+
+
+class _Client:
+    def __init__(self, ws, queue_size:int):
+        self.ws = ws
+        self.queue_size = queue_size
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        # Frames this client never received, because it was too slow.
+        self.dropped = 0
+
+    def put(self, message:bytes):
+        if len(self.queue) >= self.queue_size:
+            # Too far behind, only the latest frame matters.
+            self.dropped += len(self.queue)
+            self.queue.clear()
+        self.queue.append(message)
+        self.ready.set()
+
+    async def send_forever(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue:
+                    await self.ws.send_bytes(self.queue.popleft())
+        except ConnectionResetError:
+            # The client is gone, the handler cleans up.
+            pass
+
+
+class WebSocketMirror:
+    def __init__(self, loop=None, queue_size:int = 4, on_frame=None):
+        '''
+        Parameters:
+        loop: The asyncio loop of the web app, the running loop by default
+        queue_size: How many frames can wait for each client, before its queue is dropped down to the latest frame
+        on_frame: Function called with each frame pushed by a client (bytes or str)
+        '''
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+        self.queue_size = queue_size
+        self.on_frame = on_frame
+        self.clients = []
+        # The latest message, sent right away to new clients.
+        self.last_message = None
+        # Frames dropped for the clients that are already gone.
+        self._dropped = 0
+
+    def __repr__(self):
+        return 'WebSocketMirror(clients={0})'.format(len(self.clients))
+
+    @property
+    def dropped(self) -> int:
+        '''How many frames were dropped in total, because of slow clients.'''
+        return self._dropped + sum(client.dropped for client in self.clients)
+
+    def show(self, frame:bytes, brightness:int):
+        '''TM1640 output, called from the thread that writes to the display.'''
+        message = encode_message(frame, brightness)
+        self.last_message = message
+        if not self.clients:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._broadcast, message)
+        except RuntimeError:
+            # The loop is already closed, e.g. during the shutdown.
+            pass
+
+    async def close(self):
+        '''Disconnects all the clients, so the web app can shut down.'''
+        for client in list(self.clients):
+            await client.ws.close(code=WSCloseCode.GOING_AWAY, message=b'Shutting down')
+
+    def _broadcast(self, message:bytes):
+        for client in self.clients:
+            client.put(message)
+
+    async def handle(self, request):
+        '''aiohttp handler for the WebSocket endpoint.'''
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = _Client(ws, self.queue_size)
+        self.clients.append(client)
+        sender = asyncio.create_task(client.send_forever())
+        if self.last_message is not None:
+            client.put(self.last_message)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.BINARY:
+                    if len(msg.data) > 16:
+                        await ws.send_str('The payload must be at most 16 bytes, received {0} bytes'.format(len(msg.data)))
+                    elif self.on_frame is not None:
+                        self.on_frame(msg.data)
+                elif msg.type == WSMsgType.TEXT:
+                    if self.on_frame is not None:
+                        self.on_frame(msg.data)
+        finally:
+            sender.cancel()
+            self.clients.remove(client)
+            self._dropped += client.dropped
+        return ws